@@ -24,9 +24,14 @@ TODO: 5. Allow the script to automatically assign the proper codec with the resp
 TODO: 6. Run proper tests to document when video compiler corruption happens.
 '''
 import os
+import re
 from moviepy import ImageClip, concatenate_videoclips, AudioFileClip,TextClip,CompositeVideoClip,vfx
 import pysrt 
 import json
+import tempfile
+from assembly.scripts.subtitle_renderer import SubtitleRenderer
+from assembly.scripts.audio_timing import build_timing_table
+from scene_table import load_scene_table
 
 def check_file_exists(file_path):
     """Check if a file exists at the specified path."""
@@ -42,6 +47,12 @@ def check_folder_exists(folder_path):
     else:
         raise FileNotFoundError(f"Folder not found at {folder_path}")
     
+def scene_index(file_name):
+    """Sort key of a numbered file : the integer after the last `_` of the name, files without one come last."""
+    match = re.search(r"_(\d+)\.[^.]+$", file_name)
+    return (0, int(match.group(1)), file_name) if match else (1, 0, file_name)
+
+
 def get_files(folder, extensions):
     """
     Retrieves files with specified extensions from a folder.
@@ -55,7 +66,7 @@ def get_files(folder, extensions):
         return [
             os.path.join(folder, file)
             # Files are numbered , so that after sorting they are compiled into the video in that order.
-            for file in sorted(os.listdir(folder),key=lambda x: int(x.split('_')[1].split('.')[0]))  
+            for file in sorted(os.listdir(folder), key=scene_index)
             if file.lower().endswith(extensions)
         ]
     else:
@@ -114,21 +125,13 @@ def create_srt(text :str,
 def extract_topic_from_json(file_path):
     '''
     extract_topic_from_json extract() takes json file path as input.
-    - Opens the file as read-only and loads the JSON data from it.
-    - Extracts the topic from the JSON data.
+    - Loads the scene table of the script, see `scene_table.load_scene_table`.
+    - Extracts the topic from it.
 
     On success, it returns the topic of the video.
     '''
     try:
-        # Open the JSON file
-        with open(file_path, 'r') as file:
-            # Load JSON data from the file
-            data = json.load(file)
-            
-            # Extract the topic, and audio_script from the JSON data
-            topic = data.get('topic', 'No topic found')
-            
-            return topic
+        return load_scene_table(file_path)["topic"] or 'No topic found'
     except FileNotFoundError:
         print(f"Error: The file {file_path} was not found.")
     except json.JSONDecodeError:
@@ -140,23 +143,12 @@ def extract_topic_from_json(file_path):
 def extract_audio_from_json(file_path):
     '''
     extract_audio_topic_from_json() takes json file path as input.
-    - Opens the file as read-only and loads the JSON data from it.
-    - Extracts the audio_script from the JSON data.
+    - Loads the scene table of the script, see `scene_table.load_scene_table`.
 
-    On success, it returns audio_script.
+    On success, it returns the scenes of the table as dicts, with the `text`, `speaker` and `speed` of every audio segment.
     '''
     try:
-        # Open the JSON file
-        with open(file_path, 'r') as file:
-            # Load JSON data from the file
-            data = json.load(file)
-            
-            # Extract the topic, audio_script and visual_script
-            topic = data.get('topic', 'No topic found')
-            audio_script = data.get('audio_script', [])
-            # visual_script = data.get('visual_script', [])
-
-            return audio_script
+        return [scene._asdict() for scene in load_scene_table(file_path)["scenes"]]
     except FileNotFoundError:
         print(f"Error: The file {file_path} was not found.")
     except json.JSONDecodeError:
@@ -168,26 +160,58 @@ def extract_audio_from_json(file_path):
 def json_extract(json_path):
     '''
     json_extract() takes json file path as input.
-    - Calls the extract_audio_from_json() to extract the text-to-speech / subtitles from the json file,
-    and the topic of the video.
+    - Reads the narration of every scene from the scene table of the script.
 
-    On success, it returns the subtitles in list format, and the topic.
+    On success, it returns the subtitles in list format.
     '''
-    
-    # Extract parameters from json file
-    audio_script = extract_audio_from_json(json_path)
-    if audio_script:
-        # print("Extracted Audio Parameters:")
-        audio_data = []
-        for item in audio_script:
-            if 'text' in item:
-                text = item['text']
-                audio_data.append(text)
-        return audio_data
+    scenes = load_scene_table(json_path)["scenes"]
+    if scenes:
+        return [scene.text for scene in scenes]
     else:
         raise FileNotFoundError("No audio script found in the JSON file.")
     
 
+def build_subtitle_cues(subtitles, timing, chunk_size=10):
+    """
+    Builds the subtitle cues of the whole video in a single pass over the script.
+    If an entry of the timing table has word timestamps (saved by the TTS stage next to the audio file), the chunks are
+    cut at word boundaries and get the exact times of their words. Otherwise every chunk gets a share of the audio
+    duration proportional to its number of words.
+    Parameters:
+        subtitles (list): Narration text of every segment, from `json_extract`.
+        timing (list): Timing table from `build_timing_table`.
+        chunk_size (int): Maximum number of words per subtitle chunk.
+    Returns:
+        list: List of `(start, end, text)` tuples in seconds, sorted by start time.
+    """
+    cues = []
+    for text, entry in zip(subtitles, timing):
+        segment_cues = []
+        if entry.get("words"):
+            chunk = []
+            word_count = 0
+            for word in entry["words"] + [None]:
+                is_word = word is not None and any(c.isalnum() for c in word[0])
+                if chunk and (word is None or (is_word and word_count == chunk_size)):
+                    segment_cues.append([entry["start"] + chunk[0][1], "".join(w[0] for w in chunk).strip()])
+                    chunk = []
+                    word_count = 0
+                if word is not None:
+                    chunk.append(word)
+                    word_count += is_word
+        else:
+            words = text.split()
+            start = entry["start"]
+            for i in range(0, len(words), chunk_size):
+                segment_cues.append([start, " ".join(words[i:i + chunk_size])])
+                start += entry["duration"] * (len(words[i:i + chunk_size]) / len(words))
+        # Every chunk is shown until the next one starts, the last one until the end of the audio.
+        for i, (start, chunk) in enumerate(segment_cues):
+            end = segment_cues[i + 1][0] if i + 1 < len(segment_cues) else entry["end"]
+            cues.append((start, end, chunk))
+    return cues
+
+
 def add_effects(clip):
     """
     Adds a effect from a curated list to the video clip.
@@ -244,7 +268,12 @@ def create_video(image_folder :str,
                 script_path : str,
                 font_path : str ,
                 output_file : str,
-                with_subtitles :bool = False):
+                with_subtitles :bool = False,
+                engine : str = "moviepy",
+                segmented : bool = False,
+                workers : int = None,
+                incremental : bool = False,
+                timing : list = None):
     """
     Main function that creates the video. The function works in 3 parts:
     1. Checks if the given parameters are correct.
@@ -261,8 +290,18 @@ def create_video(image_folder :str,
         font_path (str)    : Path to of the Font File, must be a True type or an Open Type Font
         output_file (str)  : Name of the output video file, a path can also be given.
         with_subtitles (bool) : When set to `true` embeds the subtitles in the video.
+        engine (str) : `moviepy` composites every frame with MoviePy, `ffmpeg` builds the same video with a single
+        ffmpeg filtergraph, which is much faster for still images.
+        segmented (bool) : Only with the `ffmpeg` engine. Encodes the intro, every scene and the outro as independent
+        segments in parallel and joins them without re-encoding.
+        workers (int) : Number of segments encoded at the same time when `segmented` is set.
+        incremental (bool) : Only with the `ffmpeg` engine, implies `segmented`. Records a content hash per scene in a
+        manifest next to the output and only re-encodes the scenes that changed since the last run.
+        timing (list) : Timing table from `build_timing_table`, probed from `audio_folder` if not given. Pass the same
+        table to `create_complete_srt` so the audio files are only probed once per run.
     Raises:
         FileNotFoundError: If images, audio or subtitles are not detected.
+        ValueError: If the engine is unknown.
     """
     check_folder_exists(image_folder)
     check_folder_exists(audio_folder)
@@ -271,7 +310,28 @@ def create_video(image_folder :str,
     
     images = get_files(image_folder, ('.jpg', '.png'))
     audio_files = get_files(audio_folder, ('.mp3', '.wav'))
-    subtitles = json_extract(script_path)
+    table = load_scene_table(script_path)
+    topic = table["topic"]
+    subtitles = [scene.text for scene in table["scenes"]]
+    if not len(images) == len(audio_files) == len(subtitles):
+        print(f"Warning : {len(table['scenes'])} scenes, {len(images)} images and {len(audio_files)} audio files, "
+            f"only the first {min(len(images), len(audio_files), len(subtitles))} scenes are used.")
+    if timing is None:
+        timing = build_timing_table(audio_files)
+    if engine == "ffmpeg":
+        from assembly.scripts.ffmpeg_assembly import create_video_ffmpeg
+        with tempfile.TemporaryDirectory() as workdir:
+            subtitle_path = None
+            if with_subtitles:
+                subtitle_path = os.path.join(workdir, "subtitles.srt")
+                create_complete_srt(script_path, audio_folder, subtitle_path, chunk_size=10, timing=timing)
+            create_video_ffmpeg(images, audio_files, topic, font_path, output_file, subtitle_path,
+                                segmented=segmented, workers=workers, incremental=incremental,
+                                durations=[entry["duration"] for entry in timing])
+        print(f"Video created successfully: {output_file}")
+        return
+    elif engine != "moviepy":
+        raise ValueError(f"Unknown engine : {engine}, use 'moviepy' or 'ffmpeg'")
     raw_clips = []
     audio_durations = []
     Start_duration = 0
@@ -281,20 +341,19 @@ def create_video(image_folder :str,
     path_to_background = "resources/Intro/intro.jpg"
     check_file_exists(path_to_background)
     check_file_exists(font_path)
-    topic = extract_topic_from_json(script_path)
     intro_clip = create_intro_clip(path_to_background, duration=5, topic=topic, font_path=font_path)
     raw_clips.append(intro_clip)
     
     # Create different clips with audio
-    for img, audio in zip(images,audio_files):
+    for img, audio, entry in zip(images,audio_files,timing):
         audio_clip = AudioFileClip(audio)
-        image_clip = ImageClip(img).with_duration(audio_clip.duration).with_audio(audio_clip)
+        image_clip = ImageClip(img).with_duration(entry["duration"]).with_audio(audio_clip)
         # Debug Text for subtitle synchronisation:
         # print(f"Start : {Start_duration}")
-        # print(f"End : {audio_clip.duration+Start_duration}")
-        audio_durations.append(audio_clip.duration)
+        # print(f"End : {entry['duration']+Start_duration}")
+        audio_durations.append(entry["duration"])
         print(f"Video Clip no. {images.index(img)+1} successfully created")
-        Start_duration += audio_clip.duration
+        Start_duration += entry["duration"]
         image_clip = add_effects(image_clip)
         raw_clips.append(image_clip)            
     
@@ -325,44 +384,10 @@ def create_video(image_folder :str,
     FIX: Make it such that concatenation is done only on the image clips and composite video clip is added later on with the 
     '''
     if with_subtitles == True:
-        Start_duration = 5
-        subtitle_clips = []
-        chunk = ''
-        chunks = []
-        chunk_duration = 0
-        chunk_durations = []
-        chunk_size = 10
-        for text,duration in zip(subtitles,audio_durations):
-            words = text.split()
-            if len(words) > chunk_size:
-                for i in range(0,len(words),chunk_size):
-                    chunk = " ".join(words[i : (i+chunk_size if i < len(words)-1 else len(words)-1)])
-                    chunks.append(chunk)
-                    chunk_duration = duration * (len(chunk.split())/len(words))
-                    chunk_durations.append(chunk_duration)
-            else:
-                chunks.append(text)
-                chunk_durations.append(duration)
-        # For Debugging:
-        # for i in chunks:
-            # print(f"Index :{chunks.index(i)}, Text: {i}, Word Count: {len(i.split())}")
-        # print(chunk_durations)
-        for subtitle,duration in zip(chunks,chunk_durations):
-            subtitle_clip=TextClip(text=subtitle,
-                                    font=font_path, 
-                                    color='white', 
-                                    bg_color='black', 
-                                    size=(1000, 100),
-                                    method='caption',
-                                    text_align = "center",
-                                    horizontal_align = "center"
-                                    ).with_duration(duration).with_start(Start_duration).with_position('bottom')
-            subtitle_clips.append(subtitle_clip)
-            # For Debugging :
-            # print(f"Subtitle Clip no. {chunks.index(subtitle)+1} successfully created")
-            Start_duration += duration
-        subtitle_clips.insert(0,video)
-        final_video = CompositeVideoClip(subtitle_clips)
+        cues = build_subtitle_cues(subtitles, timing, chunk_size=10)
+        # Every distinct chunk is rasterized once, and a single overlay clip picks the active chunk for each frame.
+        subtitle_overlay = SubtitleRenderer(font_path, size=(1000, 100)).build_clip(cues, video.duration)
+        final_video = CompositeVideoClip([video, subtitle_overlay])
     else:
         final_video = video
     final_video.write_videofile(output_file, fps=24,threads = os.cpu_count())
@@ -380,66 +405,32 @@ def create_video(image_folder :str,
 def create_complete_srt(script_folder :str, 
             audio_file_folder : str, 
             outfile_path:str,
-            chunk_size=10):
+            chunk_size=10,
+            timing : list = None):
     """
     Creates an SRT file by extracting subtitles from the script_folder using `json_extract` function and audio files 
-    from the `audio_file` folder. Segments the subtitles into the specified chunk size and maps the duration of the chunk to the 
-    proportion of the length of the chunk.
+    from the `audio_file` folder. Segments the subtitles into the specified chunk size with `build_subtitle_cues`, using the
+    word timestamps of the TTS stage when they exist and the proportion of the length of the chunk otherwise.
     Parameters:
     script_folder (str): Path to the folder containing script json file.
     audio_file_folder (str): Path to the folder containing audio files.
     outfile_path (str): Path or Name of the SRT file given in output.
     chunk_size (str): Number of words per subtitle chunk.
+    timing (list): Timing table from `build_timing_table`, probed from `audio_file_folder` if not given.
     """
     
     script = json_extract(script_folder)
-    audio_files = get_files(audio_file_folder,(".wav",".mp3"))
-    audio_clips = []
-    [audio_clips.append(AudioFileClip(x)) for x in audio_files]
+    if timing is None:
+        timing = build_timing_table(get_files(audio_file_folder,(".wav",".mp3")))
     subs = pysrt.SubRipFile()
-    start_time = 5 
-    chunk = ''
-    chunk_duration = 0
-    end_time = 5
-    n = 1
-    for text,audio_clip in zip(script,audio_clips):
-        duration = audio_clip.duration
-        words = text.split()
-        if len(words) > chunk_size:
-            for i in range(0,len(words),chunk_size):
-                chunk = " ".join(words[i : (i+chunk_size if i < len(words)-1 else len(words)-1)])
-                chunk_duration = duration * (len(chunk.split())/len(words))
-                end_time += chunk_duration
-                subtitle = pysrt.SubRipItem(
-                    index=n,
-                    start=pysrt.SubRipTime(seconds=start_time),
-                    end=pysrt.SubRipTime(seconds=end_time),
-                    text=chunk
-                )
-                subs.append(subtitle)
-                # For Debugging:
-                # print(f"Subtitle no. {n} added successfully.")
-                # print(f"Start : {start_time}")
-                # print(f"End : {end_time}")
-                start_time = end_time
-                n+=1
-        else:
-            chunk = text
-            chunk_duration = duration
-            end_time += chunk_duration
-            subtitle = pysrt.SubRipItem(
-                index=len(subs) + 1,
-                start=pysrt.SubRipTime(seconds=start_time),
-                end=pysrt.SubRipTime(seconds=end_time),
-                text=chunk
-            )
-            subs.append(subtitle)
-            # For Debugging:
-            # print(f"Subtitle no. {n} added successfully.")
-            # print(f"Start : {start_time}")
-            # print(f"End : {end_time}")
-            start_time = end_time
-            n+=1
+    for n, (start_time, end_time, chunk) in enumerate(build_subtitle_cues(script, timing, chunk_size), start=1):
+        subtitle = pysrt.SubRipItem(
+            index=n,
+            start=pysrt.SubRipTime(seconds=start_time),
+            end=pysrt.SubRipTime(seconds=end_time),
+            text=chunk
+        )
+        subs.append(subtitle)
             
     subs.save(outfile_path)
     print(f"File saved successfully at {outfile_path}")
@@ -0,0 +1,56 @@
+'''
+README : Lightweight audio duration probing shared by subtitle generation and video assembly.
+WAV / FLAC / OGG durations are read straight from the file header with soundfile, no ffmpeg subprocess is started and no
+file handle is left open. Only formats soundfile cannot read (e.g. MP3) fall back to ffprobe.
+The durations are collected once per run into a timing table that `create_complete_srt` and `create_video` both consume.
+'''
+import json
+import os
+import subprocess
+import soundfile as sf
+
+HEADER_FORMATS = ('.wav', '.flac', '.ogg')
+
+
+def probe_duration(file_path):
+    """Returns the duration of an audio file in seconds."""
+    if file_path.lower().endswith(HEADER_FORMATS):
+        return sf.info(file_path).duration
+    output = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                            "-of", "default=noprint_wrappers=1:nokey=1", file_path],
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip())
+
+
+def build_timing_table(audio_files, offset=5):
+    """
+    Probes every audio file once and lays the segments out on the video timeline.
+    Parameters:
+        audio_files (list): Sorted list of audio file paths.
+        offset (float): Start time of the first segment, i.e. the duration of the intro clip.
+    Returns:
+        list: One dict per audio file with the keys `file`, `duration`, `start`, `end` (in seconds) and `words`, the word
+        timestamps of the TTS stage or `None` if the audio file has no sidecar.
+    """
+    timing = []
+    start = offset
+    for file_path in audio_files:
+        duration = probe_duration(file_path)
+        timing.append({"file": os.path.normpath(file_path), "duration": duration, "start": start, "end": start + duration,
+                    "words": load_word_timings(file_path)})
+        start += duration
+    return timing
+
+
+def load_word_timings(audio_path):
+    """
+    Loads the word timing sidecar `<name>.words.json` written next to an audio file by the TTS stage.
+    Returns:
+        list: List of `[text, start, end]` entries in seconds from the start of the audio file, or `None`.
+    """
+    sidecar = os.path.splitext(audio_path)[0] + ".words.json"
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            return json.load(f)["words"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
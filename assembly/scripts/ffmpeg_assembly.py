@@ -0,0 +1,417 @@
+'''
+README : Alternative assembly engine that builds the same video as `create_video` with a single ffmpeg call.
+Every scene is a still image, so instead of compositing every frame in Python with MoviePy, each image is looped by ffmpeg
+for the duration of its audio file. Fades, audio concatenation and burned-in subtitles are all done inside one generated
+filtergraph, which is one to two orders of magnitude faster than frame-by-frame compositing.
+Use it through `create_video(..., engine="ffmpeg")`.
+'''
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageFont
+from assembly.scripts.audio_timing import probe_duration
+from file_cache import file_hash
+
+FPS = 24
+SAMPLE_RATE = 44100
+FADE_DURATION = 1
+INTRO_DURATION = 5
+
+
+def escape_filter_path(path):
+    '''Escapes a file path so it can be used as an option value inside a filtergraph.'''
+    return path.replace("\\", "/").replace(":", "\\\\:").replace("'", "\\\\\\'")
+
+
+def get_canvas_size(image_paths):
+    """
+    Returns the size of the output video. Same as MoviePy's `compose` method, the largest width and height of all images
+    are used and smaller images get black bars. Both sides are rounded up to an even number, as required by yuv420p.
+    """
+    width, height = 0, 0
+    for path in image_paths:
+        with Image.open(path) as img:
+            width = max(width, img.width)
+            height = max(height, img.height)
+    return width + width % 2, height + height % 2
+
+
+def render_title_frame(background_image_path, text, font_path, output_path):
+    '''Renders the intro / outro card once to a PNG, using the same layout as `create_intro_clip`.'''
+    from assembly.scripts.assembly_video import create_intro_clip
+    clip = create_intro_clip(background_image_path, duration=INTRO_DURATION, topic=text, font_path=font_path)
+    clip.save_frame(output_path, t=0)
+    clip.close()
+    return output_path
+
+
+def build_filtergraph(durations, fades, canvas_size, subtitle_path=None, font_path=None):
+    """
+    Builds the filtergraph for a list of still-image segments.
+    Parameters:
+        durations (list): Duration of every segment in seconds, input `2*i` is the image and `2*i + 1` the audio of segment i.
+        fades (list): For every segment, `True` to add a fade in and fade out.
+        canvas_size (tuple): Width and height of the output video.
+        subtitle_path (str): Path to an .srt file to burn in, or `None`.
+        font_path (str): Path to the font used for the subtitles.
+    Returns:
+        str: The filtergraph, the output pads are `[vout]` and `[aout]`.
+    """
+    width, height = canvas_size
+    filters = []
+    pads = []
+    for i, (duration, fade) in enumerate(zip(durations, fades)):
+        video = (f"[{2 * i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={FPS},format=yuv420p")
+        if fade:
+            fade_duration = min(FADE_DURATION, duration / 2)
+            video += f",fade=t=in:st=0:d={fade_duration},fade=t=out:st={duration - fade_duration:.3f}:d={fade_duration}"
+        filters.append(f"{video},trim=duration={duration}[v{i}]")
+        # Audio is padded / trimmed to exactly the segment duration so audio and video stay in sync after concat.
+        filters.append(f"[{2 * i + 1}:a]aresample={SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+                    f"apad,atrim=duration={duration}[a{i}]")
+        pads.append(f"[v{i}][a{i}]")
+    video_out = "[vcat]" if subtitle_path else "[vout]"
+    filters.append(f"{''.join(pads)}concat=n={len(durations)}:v=1:a=1{video_out}[aout]")
+    if subtitle_path:
+        font_name = ImageFont.truetype(font_path).getname()[0]
+        style = f"FontName={font_name},FontSize=18,PrimaryColour=&H00FFFFFF,BackColour=&H00000000,BorderStyle=3,Alignment=2"
+        filters.append(f"[vcat]subtitles=filename={escape_filter_path(subtitle_path)}"
+                    f":fontsdir={escape_filter_path(os.path.dirname(os.path.abspath(font_path)))}"
+                    f":force_style='{style}'[vout]")
+    return ";\n".join(filters)
+
+
+def run_ffmpeg(inputs, filtergraph, output_file, workdir, threads=None, script_name="filtergraph.txt"):
+    """
+    Runs ffmpeg with the given inputs and filtergraph. The filtergraph is passed through a script file, so that long
+    videos do not hit the command line length limit.
+    Every encode uses the same codec parameters, so segments encoded separately can be joined without re-encoding.
+    Parameters:
+        inputs (list): List of input argument lists, e.g. `["-loop", "1", "-t", "5", "-i", "image.png"]`.
+        filtergraph (str): Filtergraph with the output pads `[vout]` and `[aout]`.
+        output_file (str): Path of the output video.
+        workdir (str): Folder for the filtergraph script.
+        threads (int): Number of encoder threads, defaults to the number of CPUs.
+        script_name (str): File name of the filtergraph script inside `workdir`.
+    """
+    script_file = os.path.join(workdir, script_name)
+    with open(script_file, "w", encoding="utf-8") as f:
+        f.write(filtergraph)
+    command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+    for input_args in inputs:
+        command += input_args
+    command += ["-filter_complex_script", script_file, "-map", "[vout]", "-map", "[aout]",
+                "-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p", "-r", str(FPS),
+                "-c:a", "libmp3lame", "-ar", str(SAMPLE_RATE), "-ac", "2",
+                "-threads", str(threads or os.cpu_count()), output_file]
+    subprocess.run(command, check=True)
+
+
+def segment_inputs(image, audio, duration):
+    """Returns the ffmpeg input arguments of a single still-image segment, `audio` is `None` for a silent segment."""
+    inputs = [["-loop", "1", "-framerate", str(FPS), "-t", str(duration), "-i", image]]
+    if audio is None:
+        inputs.append(["-f", "lavfi", "-t", str(duration), "-i", f"anullsrc=r={SAMPLE_RATE}:cl=stereo"])
+    else:
+        inputs.append(["-i", audio])
+    return inputs
+
+
+def split_srt(subtitle_path, segment_durations, workdir):
+    """
+    Splits an .srt file covering the whole video into one .srt file per segment, with the times shifted so that every
+    file starts at 0. Cues are assigned to the segment in which they start.
+    Parameters:
+        subtitle_path (str): Path to the .srt file of the whole video.
+        segment_durations (list): Duration of every segment in seconds.
+        workdir (str): Folder for the per segment .srt files.
+    Returns:
+        list: Path of the .srt file of every segment, `None` for segments without subtitles.
+    """
+    import pysrt
+    subs = pysrt.open(subtitle_path)
+    paths = []
+    start = 0
+    for i, duration in enumerate(segment_durations):
+        end = start + duration
+        segment_subs = pysrt.SubRipFile()
+        for item in subs:
+            item_start = item.start.ordinal / 1000
+            if start <= item_start < end:
+                item_end = min(item.end.ordinal / 1000, end)
+                segment_subs.append(pysrt.SubRipItem(index=len(segment_subs) + 1,
+                                                    start=pysrt.SubRipTime(seconds=item_start - start),
+                                                    end=pysrt.SubRipTime(seconds=item_end - start),
+                                                    text=item.text))
+        if len(segment_subs):
+            path = os.path.join(workdir, f"segment_{i}.srt")
+            segment_subs.save(path)
+            paths.append(path)
+        else:
+            paths.append(None)
+        start = end
+    return paths
+
+
+def encode_segment(segment, canvas_size, font_path, workdir, threads=None, retries=1):
+    """
+    Encodes a single segment to its own file, retrying a failed encode up to `retries` times.
+    Parameters:
+        segment (dict): Dict with the keys `index`, `image`, `audio`, `duration`, `fade`, `subtitles` and `output`.
+    Returns:
+        str: Path of the encoded segment.
+    """
+    filtergraph = build_filtergraph([segment["duration"]], [segment["fade"]], canvas_size, segment["subtitles"], font_path)
+    # Encode to a temporary name first, so an interrupted encode never leaves a broken file at the final path.
+    root, extension = os.path.splitext(segment["output"])
+    partial_output = f"{root}.part{extension}"
+    for attempt in range(retries + 1):
+        try:
+            run_ffmpeg(segment_inputs(segment["image"], segment["audio"], segment["duration"]), filtergraph,
+                    partial_output, workdir, threads, script_name=f"filtergraph_{segment['index']}.txt")
+            os.replace(partial_output, segment["output"])
+            return segment["output"]
+        except subprocess.CalledProcessError:
+            if attempt == retries:
+                raise
+            print(f"Encoding segment {segment['index']} failed, retrying ...")
+
+
+def segment_hash(segment, canvas_size, font_hash):
+    """
+    Returns a content hash of everything that affects the encoded segment: the image, the audio, the subtitle text,
+    the effect and encoding parameters and the font.
+    """
+    subtitles = ""
+    if segment["subtitles"]:
+        with open(segment["subtitles"], "r", encoding="utf-8") as f:
+            subtitles = f.read()
+    params = {
+        "image": file_hash(segment["image"]),
+        "audio": file_hash(segment["audio"]) if segment["audio"] else None,
+        "subtitles": subtitles,
+        "effects": [segment["duration"], segment["fade"], FADE_DURATION, FPS, SAMPLE_RATE, list(canvas_size)],
+        "font": font_hash,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_manifest(manifest_path):
+    """Loads the manifest of the previous run, returns an empty manifest if there is none or it is unreadable."""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"segments": []}
+
+
+def concat_segments(segment_files, output_file, workdir):
+    """Joins encoded segments with the concat demuxer, the streams are copied without re-encoding."""
+    list_file = os.path.join(workdir, "segments.txt")
+    with open(list_file, "w", encoding="utf-8") as f:
+        for path in segment_files:
+            escaped = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                    "-i", list_file, "-c", "copy", output_file], check=True)
+
+
+def create_video_ffmpeg(images, audio_files, topic, font_path, output_file, subtitle_path=None,
+                        path_to_background="resources/Intro/intro.jpg", segmented=False, workers=None,
+                        incremental=False, durations=None):
+    """
+    Creates the video with ffmpeg: intro card, one still image per audio file with fades, outro card and optionally
+    burned-in subtitles from an .srt file.
+    Parameters:
+        images (list): Sorted list of image paths.
+        audio_files (list): Sorted list of audio paths, one per image.
+        topic (str): Text of the intro card.
+        font_path (str): Path to the True type or Open type font.
+        output_file (str): Path of the output video.
+        subtitle_path (str): Path to the .srt file to burn in, or `None` for no subtitles.
+        path_to_background (str): Background image of the intro and outro cards.
+        segmented (bool): When `True`, the intro, every scene and the outro are encoded as independent segments in
+        parallel, and then joined with a stream-copy concat. A failed scene is retried on its own.
+        workers (int): Number of segments encoded at the same time, defaults to the number of CPUs.
+        incremental (bool): Implies `segmented`. Keeps the encoded segments in a cache folder next to the output and
+        writes a manifest with a content hash per segment. On the next run only the segments whose hash changed are
+        re-encoded.
+        durations (list): Duration of every audio file in seconds, probed if not given.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        intro = render_title_frame(path_to_background, topic, font_path, os.path.join(workdir, "intro.png"))
+        outro_text = "Thank you for watching! Made by ForgeTube team."
+        outro = render_title_frame(path_to_background, outro_text, font_path, os.path.join(workdir, "outro.png"))
+
+        # Every segment is a still image with an optional audio file: intro, scenes and outro.
+        segments = [{"image": intro, "audio": None, "duration": INTRO_DURATION, "fade": False}]
+        if durations is None:
+            durations = [probe_duration(audio) for audio in audio_files]
+        for idx, (img, audio, duration) in enumerate(zip(images, audio_files, durations)):
+            segments.append({"image": img, "audio": audio, "duration": duration, "fade": True})
+            print(f"Video Clip no. {idx + 1} successfully added")
+        segments.append({"image": outro, "audio": None, "duration": INTRO_DURATION, "fade": False})
+
+        canvas_size = get_canvas_size([segment["image"] for segment in segments])
+        segment_durations = [segment["duration"] for segment in segments]
+        if not (segmented or incremental):
+            inputs = []
+            for segment in segments:
+                inputs += segment_inputs(segment["image"], segment["audio"], segment["duration"])
+            filtergraph = build_filtergraph(segment_durations, [segment["fade"] for segment in segments], canvas_size,
+                                            subtitle_path, font_path)
+            run_ffmpeg(inputs, filtergraph, output_file, workdir)
+            return
+
+        subtitles = split_srt(subtitle_path, segment_durations, workdir) if subtitle_path else [None] * len(segments)
+        extension = os.path.splitext(output_file)[1] or ".mp4"
+        output_root = os.path.splitext(output_file)[0]
+        segment_dir = f"{output_root}_segments"
+        manifest_path = f"{output_root}.manifest.json"
+        if incremental:
+            os.makedirs(segment_dir, exist_ok=True)
+            previous = {entry["hash"] for entry in load_manifest(manifest_path)["segments"]}
+            font_hash = file_hash(font_path)
+        for i, segment in enumerate(segments):
+            segment.update(index=i, subtitles=subtitles[i])
+            if incremental:
+                segment["hash"] = segment_hash(segment, canvas_size, font_hash)
+                segment["output"] = os.path.join(segment_dir, f"{segment['hash']}{extension}")
+            else:
+                segment["output"] = os.path.join(workdir, f"segment_{i}{extension}")
+
+        to_encode = []
+        for segment in segments:
+            if incremental and segment["hash"] in previous and os.path.isfile(segment["output"]):
+                print(f"Segment {segment['index']} unchanged, reusing {segment['output']}")
+            else:
+                to_encode.append(segment)
+
+        # The encodes run as separate ffmpeg processes, the threads only wait on them.
+        workers = workers or os.cpu_count()
+        threads = max(1, os.cpu_count() // workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(encode_segment, segment, canvas_size, font_path, workdir, threads)
+                    for segment in to_encode]
+            for future in futures:
+                future.result()
+        concat_segments([segment["output"] for segment in segments], output_file, workdir)
+
+        if incremental:
+            manifest = {"output": output_file,
+                        "segments": [{"index": segment["index"], "hash": segment["hash"],
+                                    "file": os.path.basename(segment["output"])} for segment in segments]}
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            # Drop segments that are no longer part of the video, so the cache does not grow forever.
+            keep = {entry["file"] for entry in manifest["segments"]}
+            for file in os.listdir(segment_dir):
+                if file not in keep:
+                    os.remove(os.path.join(segment_dir, file))
+
+
+class StreamingAssembler:
+    """
+    Encodes the video scene by scene while the images and audio are still being generated.
+    As soon as scene k has both its image and its audio file, its segment is encoded in the background, with its
+    subtitles burned in. `finish` only encodes the intro and outro cards and joins the pre-encoded segments with a
+    stream-copy concat, so the time to the finished video is dominated by the slowest single scene.
+    Parameters:
+        subtitles (list): Narration text of every scene, in order. Scenes are not subtitled if `with_subtitles` is `False`.
+        font_path (str): Path to the True type or Open type font.
+        output_file (str): Path of the output video.
+        with_subtitles (bool): Burn the subtitles into every scene.
+        canvas_size (tuple): Size of the output video, every image is scaled and padded to it.
+        workers (int): Number of scenes encoded at the same time, defaults to the number of CPUs.
+    """
+
+    def __init__(self, subtitles, font_path, output_file, with_subtitles=True, canvas_size=(1920, 1080), workers=None):
+        self.subtitles = subtitles
+        self.font_path = font_path
+        self.output_file = output_file
+        self.with_subtitles = with_subtitles
+        self.canvas_size = canvas_size
+        self.extension = os.path.splitext(output_file)[1] or ".mp4"
+        self.workdir = tempfile.mkdtemp()
+        self.workers = workers or os.cpu_count()
+        self.threads = max(1, os.cpu_count() // self.workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+        self.images = {}
+        self.audio = {}
+        self.futures = {}
+
+    def add_image(self, index, file_path):
+        """Registers the image of scene `index`, can be used directly as the `on_saved` callback of the image stage."""
+        with self.lock:
+            self.images[index] = file_path
+            self._submit_if_ready(index)
+
+    def add_audio(self, index, file_path):
+        """Registers the audio of scene `index`, can be used directly as the `on_saved` callback of the audio stage."""
+        with self.lock:
+            self.audio[index] = file_path
+            self._submit_if_ready(index)
+
+    def _submit_if_ready(self, index):
+        if index in self.images and index in self.audio and index not in self.futures:
+            self.futures[index] = self.executor.submit(self._encode_scene, index)
+
+    def _encode_scene(self, index):
+        from assembly.scripts.audio_timing import build_timing_table
+        audio = self.audio[index]
+        timing = build_timing_table([audio], offset=0)
+        subtitle_path = None
+        if self.with_subtitles and index < len(self.subtitles):
+            from assembly.scripts.assembly_video import build_subtitle_cues
+            import pysrt
+            subs = pysrt.SubRipFile()
+            for n, (start, end, text) in enumerate(build_subtitle_cues([self.subtitles[index]], timing), start=1):
+                subs.append(pysrt.SubRipItem(index=n, start=pysrt.SubRipTime(seconds=start),
+                                            end=pysrt.SubRipTime(seconds=end), text=text))
+            subtitle_path = os.path.join(self.workdir, f"scene_{index}.srt")
+            subs.save(subtitle_path)
+        segment = {"index": index + 1, "image": self.images[index], "audio": audio, "duration": timing[0]["duration"],
+                "fade": True, "subtitles": subtitle_path,
+                "output": os.path.join(self.workdir, f"scene_{index}{self.extension}")}
+        output = encode_segment(segment, self.canvas_size, self.font_path, self.workdir, self.threads)
+        print(f"Scene {index} encoded")
+        return output
+
+    def finish(self, topic, scene_count, path_to_background="resources/Intro/intro.jpg"):
+        """
+        Waits for the scene encodes, encodes the intro and outro and joins everything into `output_file`.
+        Parameters:
+            topic (str): Text of the intro card.
+            scene_count (int): Number of scenes the video must contain.
+        Raises:
+            RuntimeError: If a scene never received both its image and its audio.
+        """
+        try:
+            missing = [index for index in range(scene_count) if index not in self.futures]
+            if missing:
+                raise RuntimeError(f"Scenes {missing} are missing their image or audio file.")
+            scene_files = [self.futures[index].result() for index in range(scene_count)]
+            intro = render_title_frame(path_to_background, topic, self.font_path, os.path.join(self.workdir, "intro.png"))
+            outro_text = "Thank you for watching! Made by ForgeTube team."
+            outro = render_title_frame(path_to_background, outro_text, self.font_path, os.path.join(self.workdir, "outro.png"))
+            cards = []
+            for index, image in [(0, intro), (scene_count + 1, outro)]:
+                cards.append(self.executor.submit(encode_segment, {
+                    "index": index, "image": image, "audio": None, "duration": INTRO_DURATION, "fade": False,
+                    "subtitles": None, "output": os.path.join(self.workdir, f"card_{index}{self.extension}")},
+                    self.canvas_size, self.font_path, self.workdir, self.threads))
+            concat_segments([cards[0].result()] + scene_files + [cards[1].result()], self.output_file, self.workdir)
+        finally:
+            self.close()
+
+    def close(self):
+        """Waits for the running encodes and deletes the temporary segments."""
+        self.executor.shutdown(wait=True)
+        shutil.rmtree(self.workdir, ignore_errors=True)
@@ -0,0 +1,80 @@
+'''
+README : Renders burned-in subtitles as a single overlay clip.
+Every distinct subtitle chunk is rasterized only once into an RGBA bitmap, cached on (text, font, size). The overlay looks
+up the subtitle active at time t with a binary search over the sorted cue start times, so the cost of a frame does not
+grow with the number of subtitle chunks, unlike stacking one `TextClip` per chunk in a `CompositeVideoClip`.
+'''
+from bisect import bisect_right
+import numpy as np
+from moviepy import TextClip, VideoClip
+
+
+class SubtitleRenderer:
+    """
+    Rasterizes subtitle chunks and builds the overlay clip.
+    Parameters:
+        font_path (str): Path to the True type or Open type font.
+        size (tuple): Size of the subtitle box in pixels.
+    """
+
+    def __init__(self, font_path, size=(1000, 100)):
+        self.font_path = font_path
+        self.size = size
+        self._bitmaps = {}
+
+    def rasterize(self, text):
+        """
+        Returns the RGB frame and the alpha mask of a subtitle chunk, rendering it only on the first call.
+        The layout is the same as the per chunk `TextClip` used before: white text, black background, centered caption.
+        """
+        key = (text, self.font_path, self.size)
+        if key not in self._bitmaps:
+            clip = TextClip(text=text,
+                            font=self.font_path,
+                            color='white',
+                            bg_color='black',
+                            size=self.size,
+                            method='caption',
+                            text_align="center",
+                            horizontal_align="center",
+                            duration=1)
+            rgb = clip.get_frame(0)
+            alpha = clip.mask.get_frame(0) if clip.mask is not None else np.ones(rgb.shape[:2])
+            self._bitmaps[key] = (rgb, alpha)
+            clip.close()
+        return self._bitmaps[key]
+
+    def build_clip(self, cues, duration):
+        """
+        Builds one overlay clip for all the subtitles.
+        Parameters:
+            cues (list): List of `(start, end, text)` tuples in seconds, sorted by start time and not overlapping.
+            duration (float): Duration of the overlay, usually the duration of the whole video.
+        Returns:
+            VideoClip: Clip with a mask, positioned at the bottom of the video.
+        """
+        starts = [start for start, _, _ in cues]
+        ends = [end for _, end, _ in cues]
+        texts = [text for _, _, text in cues]
+        for text in set(texts):
+            self.rasterize(text)
+        width, height = self.size
+        blank_rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        blank_alpha = np.zeros((height, width))
+
+        def active(t):
+            idx = bisect_right(starts, t) - 1
+            if idx >= 0 and t < ends[idx]:
+                return self.rasterize(texts[idx])
+            return None
+
+        def frame_function(t):
+            bitmap = active(t)
+            return bitmap[0] if bitmap is not None else blank_rgb
+
+        def mask_function(t):
+            bitmap = active(t)
+            return bitmap[1] if bitmap is not None else blank_alpha
+
+        mask = VideoClip(frame_function=mask_function, is_mask=True, duration=duration)
+        return VideoClip(frame_function=frame_function, duration=duration).with_mask(mask).with_position('bottom')
@@ -0,0 +1,165 @@
+'''
+README : Headless batch mode, renders many videos from a queue file.
+The queue is a JSONL file with one job per line :
+    {"id": "black_holes", "topic": "Black holes", "duration": 60, "key_points": ["Event horizon", "Hawking radiation"]}
+Optional keys per job : `feedback` (refinement instructions for the script) and the output paths `script_path`,
+`images_path`, `audio_path`, `subtitles_dir` and `video_dir`. By default every job works in `resources/jobs/<id>/`.
+Jobs run in a thread pool. One warm SDXL worker and one warm `KPipeline` are shared by all the jobs, and the number
+of jobs inside each stage at the same time is limited per stage. Every job is a resumable `PipelineRunner`, so running
+the same queue again only finishes the jobs that failed. A per-job status report is written as json.
+'''
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pipeline_runner import PipelineRunner, STAGES
+
+# Default number of jobs allowed inside each stage at the same time.
+# A single KPipeline is shared by all jobs and is not thread safe, so audio runs one job at a time. The limit is
+# pinned to 1 unless every job synthesizes on its own TTS worker processes (`tts_workers` > 1).
+DEFAULT_STAGE_LIMITS = {"script": 4, "images": 2, "audio": 1, "subtitles": 4, "video": 2}
+
+
+def load_jobs(jobs_path):
+    """Reads the jobs from a JSONL file, blank lines are ignored. Jobs without an `id` are numbered."""
+    jobs = []
+    with open(jobs_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                job = json.loads(line)
+                job.setdefault("id", f"job_{len(jobs)}")
+                jobs.append(job)
+    return jobs
+
+
+def job_config(job, jobs_dir):
+    """Builds the `PipelineRunner` config of a job, the outputs go to `jobs_dir/<id>/` unless the job gives its own paths."""
+    job_dir = os.path.join(jobs_dir, job["id"])
+    config = {
+        "script_path": os.path.join(job_dir, "script.json"),
+        "images_path": os.path.join(job_dir, "images"),
+        "audio_path": os.path.join(job_dir, "audio"),
+        "subtitles_dir": job_dir,
+        "video_dir": job_dir,
+        "feedback": "no",
+    }
+    config.update({key: value for key, value in job.items() if key != "id"})
+    return config
+
+
+def run_job(job, jobs_dir, gem_api, serp_api, local, shared, stage_limits, defaults=None):
+    """
+    Runs a single job to completion and returns its status entry for the report.
+    `defaults` are runner config values, e.g. `tts_workers` or `engine`, used when the job does not set them itself.
+    """
+    config = job_config(job, jobs_dir)
+    config.update(gem_api=gem_api, serp_api=serp_api)
+    for key, value in (defaults or {}).items():
+        config.setdefault(key, value)
+    state_path = os.path.join(jobs_dir, job["id"], "pipeline_state.json")
+    runner = PipelineRunner(config, state_path=state_path, local=local, shared=shared, stage_limits=stage_limits)
+    start_time = time.time()
+    status = {"id": job["id"], "topic": job.get("topic")}
+    try:
+        runner.run()
+        status.update(status="done", video=runner.outputs("video")[0])
+    except Exception as e:
+        traceback.print_exc()
+        status.update(status="failed", error=str(e))
+    status["seconds"] = round(time.time() - start_time, 2)
+    status["stages"] = {stage: {"status": record.get("status"), "seconds": record.get("seconds")}
+                        for stage, record in runner.state["stages"].items()}
+    return status
+
+
+def run_batch(jobs_path, gem_api, serp_api, report_path="resources/jobs/report.json", jobs_dir="resources/jobs",
+            local=False, max_jobs=4, stage_limits=None, tts_workers=1, video_options=None):
+    """
+    Runs every job of a queue file and writes the status report.
+    Parameters:
+        jobs_path (str): Path of the JSONL queue file.
+        gem_api (str): Gemini API key.
+        serp_api (str): Serp API key.
+        report_path (str): Path of the json status report.
+        jobs_dir (str): Folder with one sub folder per job.
+        local (bool): Run the image generation locally instead of on Modal.
+        max_jobs (int): Number of jobs running at the same time.
+        stage_limits (dict): Number of jobs allowed inside each stage at the same time, see `DEFAULT_STAGE_LIMITS`.
+        tts_workers (int): Number of TTS worker processes per job. With more than one, no `KPipeline` is shared and
+        every job synthesizes its audio on its own processes, so several jobs can be in the audio stage at once.
+        video_options (dict): Default assembly options of the jobs, `engine`, `segmented` and `incremental` of
+        `create_video`. A job can override them with the same keys.
+    Returns:
+        list: The status of every job.
+    """
+    from kokoro.pipeline import KPipeline
+    jobs = load_jobs(jobs_path)
+    limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+    if local:
+        # The local SDXL pipeline is cached per process and shared, but it can only run one job at a time.
+        limits["images"] = 1
+    if tts_workers <= 1 and limits["audio"] > 1:
+        # Every job synthesizes on the one shared KPipeline, which is not thread safe.
+        print(f"The audio stage shares one KPipeline, running 1 job at a time instead of {limits['audio']}. "
+            f"Use --tts-workers to give every job its own worker processes.")
+        limits["audio"] = 1
+    semaphores = {stage: threading.Semaphore(limits[stage]) for stage in STAGES}
+    shared = {}
+    if tts_workers <= 1:
+        shared["tts_pipeline"] = KPipeline(lang_code="b")
+
+    def run_all():
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            futures = [executor.submit(run_job, job, jobs_dir, gem_api, serp_api, local, shared, semaphores,
+                                    {"tts_workers": tts_workers, **(video_options or {})})
+                    for job in jobs]
+            return [future.result() for future in futures]
+
+    if local:
+        report = run_all()
+    else:
+        import modal
+        from diffusion.scripts.generate_image import app, ImageGenerator
+        with modal.enable_output():
+            with app.run():
+                # One app run for the whole batch, every job sends its scenes to the same warm worker.
+                shared["image_worker"] = ImageGenerator()
+                report = run_all()
+
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    done = sum(1 for status in report if status["status"] == "done")
+    print(f"Batch finished : {done}/{len(report)} jobs done. Report saved at {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render many videos from a JSONL queue file.")
+    parser.add_argument("jobs", help="Path of the JSONL queue file.")
+    parser.add_argument("--report", default="resources/jobs/report.json", help="Path of the json status report.")
+    parser.add_argument("--jobs-dir", default="resources/jobs", help="Folder with one sub folder per job.")
+    parser.add_argument("--local", action="store_true", help="Run the image generation locally instead of on Modal.")
+    parser.add_argument("--max-jobs", type=int, default=4, help="Number of jobs running at the same time.")
+    for stage in STAGES:
+        parser.add_argument(f"--max-{stage}", type=int, default=DEFAULT_STAGE_LIMITS[stage],
+                            help=f"Number of jobs inside the {stage} stage at the same time.")
+    parser.add_argument("--tts-workers", type=int, default=1,
+                        help="Number of TTS worker processes per job, each with its own Kokoro pipeline.")
+    parser.add_argument("--engine", choices=["moviepy", "ffmpeg"], default="moviepy", help="Video assembly engine.")
+    parser.add_argument("--segmented", action="store_true",
+                        help="Encode the intro, every scene and the outro in parallel (ffmpeg engine).")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-encode the scenes that changed since the last run of a job (ffmpeg engine).")
+    args = parser.parse_args()
+    if (args.segmented or args.incremental) and args.engine != "ffmpeg":
+        parser.error("--segmented and --incremental need --engine ffmpeg.")
+    gem_api = os.environ.get("GEMINI_API_KEY", "")
+    serp_api = os.environ.get("SERP_API_KEY", "")
+    run_batch(args.jobs, gem_api, serp_api, report_path=args.report, jobs_dir=args.jobs_dir, local=args.local,
+            max_jobs=args.max_jobs, stage_limits={stage: getattr(args, f"max_{stage}") for stage in STAGES},
+            tts_workers=args.tts_workers,
+            video_options={"engine": args.engine, "segmented": args.segmented, "incremental": args.incremental})
@@ -0,0 +1,165 @@
+'''
+README : End-to-end benchmark of the pipeline with the offline stub backends, runs without GPU, API keys or models.
+The script comes from `CannedBackend`, the images from `StubImageGenerator` and the narration from `SineTonePipeline`,
+the subtitle and video stages are the real ones. Every stage runs in its own process, so the peak memory reported for
+a stage is its own and not the largest of the stages that ran before it.
+Usage :
+    python benchmark.py --sizes 10 50 200 --report resources/benchmark/report.json
+The report has, per size and per stage, the wall time in seconds, the peak RSS of the stage process and of its children
+(ffmpeg) in MB, and the size of the stage output in bytes. With `--baseline`, the wall times are compared to an
+older report and the command exits with 1 if a stage got slower than `--tolerance`, e.g. to fail a CI job.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import time
+
+STAGES = ["script", "images", "audio", "subtitles", "video"]
+
+
+def peak_rss_mb(who):
+    """Peak resident memory of this process (`resource.RUSAGE_SELF`) or of its finished children, in MB."""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def output_size(path):
+    """Size in bytes of a file, or of all the files in a folder."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def stage_paths(work_dir):
+    """Returns the output path of every stage inside `work_dir`."""
+    return {"script": os.path.join(work_dir, "scripts", "script.json"),
+            "images": os.path.join(work_dir, "images"),
+            "audio": os.path.join(work_dir, "audio"),
+            "subtitles": os.path.join(work_dir, "subtitles", "subtitles.srt"),
+            "video": os.path.join(work_dir, "video", "video.mp4")}
+
+
+def run_stage(stage, scene_count, work_dir, engine="ffmpeg", noise=False):
+    """
+    Runs a single stage for a canned script of `scene_count` scenes in `work_dir`, the stages before it must have run.
+    Meant to run in a fresh process, so the peak RSS it reports belongs to this stage only.
+    Returns:
+        dict: `seconds`, `peak_rss_mb`, `children_peak_rss_mb` and `output_bytes` of the stage.
+    """
+    paths = stage_paths(work_dir)
+    os.makedirs(paths[stage] if stage in ("images", "audio") else os.path.dirname(paths[stage]), exist_ok=True)
+    start = time.perf_counter()
+    if stage == "script":
+        from diffusion.scripts.generate_script import VideoScriptGenerator
+        from diffusion.scripts.llm_backends import CannedBackend
+        from scene_table import normalize_script, save_scene_table
+        generator = VideoScriptGenerator(api_key="", serp_api_key="", backend=CannedBackend(scene_count),
+                                        structured_output=True, use_search_cache=False, use_response_cache=False)
+        script = normalize_script(generator.generate_script("Benchmark video", duration=scene_count * 10))
+        generator.save_script(script, paths["script"])
+        save_scene_table(paths["script"], script)
+    elif stage == "images":
+        from diffusion.scripts.generate_image import main_generate_image
+        from diffusion.scripts.generate_image_stub import StubImageGenerator
+        main_generate_image(paths["script"], paths["images"], use_cache=False, worker=StubImageGenerator(noise=noise))
+    elif stage == "audio":
+        from tts.scripts.generate_audio import main_generate_audio
+        from tts.scripts.stub_tts import SineTonePipeline
+        main_generate_audio(paths["script"], paths["audio"], use_cache=False, pipeline=SineTonePipeline())
+    elif stage == "subtitles":
+        from assembly.scripts.assembly_video import create_complete_srt
+        create_complete_srt(paths["script"], paths["audio"], paths["subtitles"])
+    else:
+        from assembly.scripts.assembly_video import create_video
+        create_video(paths["images"], paths["audio"], paths["script"], "resources/font/font.ttf", paths["video"],
+                    with_subtitles=True, engine=engine)
+    # The imports are part of the stage time, as they are in a real run.
+    return {"seconds": round(time.perf_counter() - start, 3),
+            "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+            "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "output_bytes": output_size(paths[stage])}
+
+
+def run_size(scene_count, work_dir, engine="ffmpeg", noise=False):
+    """
+    Runs every stage for a canned script of `scene_count` scenes in `work_dir`, each stage in a fresh spawned process.
+    Returns:
+        dict: `scenes` and the result of `run_stage` for every stage.
+    """
+    shutil.rmtree(work_dir, ignore_errors=True)
+    context = multiprocessing.get_context("spawn")
+    result = {"scenes": scene_count}
+    for stage in STAGES:
+        with context.Pool(1) as pool:
+            result[stage] = pool.apply(run_stage, (stage, scene_count, work_dir, engine, noise))
+        print(f"[{scene_count} scenes] {stage} : {result[stage]}")
+    return result
+
+
+def run_benchmark(sizes, work_dir="resources/benchmark", engine="ffmpeg", noise=False, keep=False):
+    """
+    Runs `run_size` for every size.
+    Returns:
+        dict: The report, with the settings and one result per size.
+    """
+    report = {"engine": engine, "noise": noise, "platform": sys.platform, "cpu_count": os.cpu_count(), "sizes": {}}
+    for scene_count in sizes:
+        size_dir = os.path.join(work_dir, f"scenes_{scene_count}")
+        report["sizes"][str(scene_count)] = run_size(scene_count, size_dir, engine, noise)
+        if not keep:
+            shutil.rmtree(size_dir, ignore_errors=True)
+    return report
+
+
+def compare_reports(report, baseline, tolerance=0.25, min_seconds=0.5):
+    """
+    Compares the wall times of `report` with `baseline`.
+    Stages faster than `min_seconds` in the baseline are skipped, their timing is mostly noise.
+    Returns:
+        list: One message per stage that got more than `tolerance` (0.25 = 25 %) slower.
+    """
+    regressions = []
+    for size, result in report["sizes"].items():
+        previous = baseline.get("sizes", {}).get(size)
+        if previous is None:
+            continue
+        for stage in STAGES:
+            before = previous.get(stage, {}).get("seconds")
+            after = result[stage]["seconds"]
+            if before is not None and before >= min_seconds and after > before * (1 + tolerance):
+                regressions.append(f"{size} scenes, {stage} : {before}s -> {after}s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline end to end with offline stub backends.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200], help="Numbers of scenes to benchmark.")
+    parser.add_argument("--report", default="resources/benchmark/report.json", help="Path of the json report.")
+    parser.add_argument("--work-dir", default="resources/benchmark", help="Folder for the outputs of every size.")
+    parser.add_argument("--engine", choices=["ffmpeg", "moviepy"], default="ffmpeg", help="Video assembly engine.")
+    parser.add_argument("--noise", action="store_true", help="Render noise images, closer to real images in size.")
+    parser.add_argument("--keep", action="store_true", help="Keep the outputs of every size.")
+    parser.add_argument("--baseline", help="Older report to compare the wall times with.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline.")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes, args.work_dir, args.engine, args.noise, args.keep)
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report saved at {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"Regression : {message}")
+        sys.exit(1 if regressions else 0)
@@ -1,7 +1,6 @@
 import modal
 import json
 import os
-import time
 from io import BytesIO
 
 image = modal.Image.debian_slim().pip_install(
@@ -13,98 +12,266 @@ image = modal.Image.debian_slim().pip_install(
 
 app = modal.App(name="ForgeTube_app")
 
-@app.function(image=image, gpu="A10G")
-def generate_image(prompt, negative_prompt="", steps=50, guidance_scale=9, width=1920, height=1080, seed=None):
-    import torch
-    from diffusers import DiffusionPipeline
+MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
 
 
-# LOADS THE DIFFUSION PIPELINE
+# WARM WORKER : LOADS THE DIFFUSION PIPELINE ONCE PER CONTAINER
 
-    pipe = DiffusionPipeline.from_pretrained("stabilityai/stable-diffusion-xl-base-1.0", 
-                                            torch_dtype=torch.float16,
-                                            use_safetensors=True, 
-                                            variant="fp16")
-    pipe.to("cuda")
+@app.cls(image=image, gpu="A10G", container_idle_timeout=300)
+class ImageGenerator:
+    """
+    Modal worker that keeps the SDXL pipeline in GPU memory between calls.
+    The weights are loaded once when the container starts, after that every call only pays for denoising.
+    The container is kept alive for `container_idle_timeout` seconds so consecutive scenes reuse it.
+    """
+    # Identity of the backend in the image cache key.
+    cache_name = MODEL_ID
 
-    generator = torch.Generator(device="cuda").manual_seed(seed) if seed else None
+    @modal.enter()
+    def load_pipeline(self):
+        import torch
+        from diffusers import DiffusionPipeline
 
-    image = pipe(
-        prompt,
-        negative_prompt=negative_prompt,
-        num_inference_steps=steps,
-        guidance_scale=guidance_scale,
-        width=width,
-        height=height,
-        generator=generator
-    ).images[0]
+        self.pipe = DiffusionPipeline.from_pretrained(MODEL_ID,
+                                                    torch_dtype=torch.float16,
+                                                    use_safetensors=True,
+                                                    variant="fp16")
+        self.pipe.to("cuda")
 
-    img_byte_arr = BytesIO()
-    image.save(img_byte_arr, format="PNG")
-    img_byte_arr.seek(0)
+    @modal.method()
+    def generate(self, scenes):
+        """
+        Generates one image per scene on the already loaded pipeline.
+        Args:
+            scenes (list): List of dicts with the keys `prompt`, `negative_prompt`, `steps`, `guidance_scale`,
+            `width`, `height` and `seed`.
+        Returns:
+            list: PNG bytes for every scene, in the same order as `scenes`.
+        """
+        return self.render(scenes)
 
-    return img_byte_arr.getvalue()
+    @modal.method()
+    def generate_batch(self, batch_index, scenes):
+        """
+        Same as `generate`, but tags the result with `batch_index` so batches can be collected out of order.
+        Returns:
+            tuple: `(batch_index, images, error)`, `images` is `None` and `error` holds the message if the batch failed.
+        """
+        try:
+            return batch_index, self.render(scenes), None
+        except Exception as e:
+            return batch_index, None, str(e)
 
+    def render(self, scenes):
+        """
+        Runs the pipeline for a list of scenes.
+        Scenes that share `width`, `height`, `steps` and `guidance_scale` are denoised together
+        in a single pipeline call with a list of prompts.
+        Args:
+            scenes (list): List of dicts with the keys `prompt`, `negative_prompt`, `steps`, `guidance_scale`,
+            `width`, `height` and `seed`.
+        Returns:
+            list: PNG bytes for every scene, in the same order as `scenes`.
+        """
+        import torch
 
-# PATH TO JSON FILE
+        images = [None] * len(scenes)
+        groups = {}
+        for idx, scene in enumerate(scenes):
+            groups.setdefault(batch_key(scene), []).append(idx)
 
-script_path = "resources/scripts/script.json"
-images_output_path = "resources/images/"
-# os.makedirs(output_path, exist_ok=True)
+        for (width, height, steps, guidance_scale), indices in groups.items():
+            # One generator per prompt keeps every scene reproducible from its own seed.
+            generators = []
+            for idx in indices:
+                seed = scenes[idx].get("seed")
+                generator = torch.Generator(device="cuda")
+                if seed is not None:
+                    generator.manual_seed(seed)
+                else:
+                    generator.seed()
+                generators.append(generator)
 
+            output = self.pipe(
+                [scenes[idx]["prompt"] for idx in indices],
+                negative_prompt=[scenes[idx].get("negative_prompt", "") for idx in indices],
+                num_inference_steps=steps,
+                guidance_scale=guidance_scale,
+                width=width,
+                height=height,
+                generator=generators
+            ).images
 
-# PROVIDE SOURCE TEXT OR PROMPT IN JSON FILE
+            for idx, image in zip(indices, output):
+                img_byte_arr = BytesIO()
+                image.save(img_byte_arr, format="PNG")
+                images[idx] = img_byte_arr.getvalue()
 
-def main_generate_image(script_path,images_output_path):
-    # JSON Decoding Error Handling
-    with open(script_path, "r", encoding="utf-8") as file:
-        try:
-            data = json.load(file)
-        except json.JSONDecodeError:
-            print("Error reading JSON file.")
-            return
-    # JSON Key Error Handling
-    if "visual_script" not in data:
-        print("Missing key in JSON.")
-        return
-    
+        return images
+
+
+def batch_key(scene):
+    """Returns the pipeline parameters that must be identical for scenes to share one batch."""
+    return (scene.get("width", 1920), scene.get("height", 1080), scene.get("steps", 50), scene.get("guidance_scale", 9))
 
-# GENERATING THE IMAGES 
-    with modal.enable_output():
-        with app.run():
-            # Looping Through the Scenes
-            for idx, scene in enumerate(data["visual_script"]):
-                try:
-                    prompt = scene["prompt"]
-                    timestamp = scene.get("timestamp", f"{idx:03d}")
-                    negative_prompt = scene.get("negative_prompt", "")
-                    steps = scene.get("steps", 50)
-                    # guidance_scale = scene.get("guidance_scale", 12)
-                    guidance_scale = 9
 
-                    # width = scene.get("width", 1024)
-                    width = 1920
-                    # height = scene.get("height", 576)
-                    height = 1080
-                    seed = scene.get("seed", None)
+def make_batches(scenes, batch_size=2):
+    """
+    Groups scenes with the same `batch_key` into batches of at most `batch_size` scenes.
+    Args:
+        scenes (list): List of scene dicts.
+        batch_size (int): Maximum number of prompts per pipeline call, limited by GPU memory.
+    Returns:
+        list: List of batches, every batch is a list of scene dicts.
+    """
+    groups = {}
+    for scene in scenes:
+        groups.setdefault(batch_key(scene), []).append(scene)
+    batches = []
+    for group in groups.values():
+        for i in range(0, len(group), batch_size):
+            batches.append(group[i:i + batch_size])
+    return batches
 
-                    scene_id = timestamp.replace(":", "-")
 
-                    image_data = generate_image.remote(prompt, negative_prompt, steps, guidance_scale, width, height, seed)
+def save_images(batch, images_data, images_output_path, cache=None, on_saved=None):
+    """
+    Writes the PNG bytes of a finished batch to `images_output_path` and adds them to the `cache` if one is given.
+    `on_saved(index, file_path)` is called for every saved image.
+    """
+    from diffusion.scripts.image_cache import write_image
+    for scene, image_data in zip(batch, images_data):
+        file_path = os.path.join(images_output_path, f"scene_{scene['scene_id']}.png")
+        write_image(file_path, image_data)
+        if cache is not None:
+            cache.store(scene["cache_key"], image_data)
+        print(f"Saved: {file_path}")
+        if on_saved is not None:
+            on_saved(scene["index"], file_path)
+
+
+def generate_scenes(worker, scenes, images_output_path, batched=True, batch_size=2, cache=None, on_saved=None):
+    """
+    Generates the images of `scenes` on a running `ImageGenerator` worker and saves them in `images_output_path`.
+    Must be called inside `app.run()`.
+    """
+    if batched:
+        batches = make_batches(scenes, batch_size)
+        # Batches fan out across containers, results are written to disk as soon as each batch finishes.
+        results = worker.generate_batch.starmap(enumerate(batches), order_outputs=False)
+        for batch_index, images_data, error in results:
+            batch = batches[batch_index]
+            if error:
+                print(f"Error processing scenes {[scene['scene_id'] for scene in batch]}: {error}")
+                continue
+            save_images(batch, images_data, images_output_path, cache, on_saved)
+    else:
+        for scene in scenes:
+            try:
+                image_data = worker.generate.remote([scene])
 
 
     # SAVING THE IMAGES IN THE OUTPUT DIRECTORY
 
-                    file_path = os.path.join(images_output_path, f"scene_{scene_id}.png")
-                    with open(file_path, "wb") as f:
-                        f.write(image_data)
+                save_images([scene], image_data, images_output_path, cache, on_saved)
+
+            except Exception as e:
+                print(f"Error processing scene {scene['scene_id']}: {e}")
 
-                    print(f"Saved: {file_path}")
 
-                    time.sleep(2)
+# PATH TO JSON FILE
+
+script_path = "resources/scripts/script.json"
+images_output_path = "resources/images/"
+# os.makedirs(output_path, exist_ok=True)
+
+
+# PROVIDE SOURCE TEXT OR PROMPT IN JSON FILE
+
+def main_generate_image(script_path,images_output_path,batched=True,batch_size=2,use_cache=True,cache_dir="resources/cache/images",on_saved=None,worker=None,only_indices=None):
+    """
+    Generates an image for every scene in the `visual_script` of the script and saves them in `images_output_path`.
+    Args:
+        script_path (str): Path to the script json file.
+        images_output_path (str): Folder where the images are saved as `scene_<id>.png`.
+        batched (bool): When `True`, scenes with the same size and steps are batched together and the batches
+        run concurrently on multiple workers. When `False`, scenes are generated one at a time on a single warm worker.
+        batch_size (int): Maximum number of prompts in a single pipeline call.
+        use_cache (bool): When `True`, scenes whose parameters were already rendered are taken from the image cache
+        instead of the GPU.
+        cache_dir (str): Folder of the image cache.
+        on_saved (callable): Called as `on_saved(index, file_path)` as soon as the image of a scene is on disk.
+        worker (ImageGenerator): An already running worker, e.g. shared by several videos inside one `app.run()`.
+        When `None`, the app is started for this call only.
+        only_indices (list): Indices of the scenes to generate, e.g. the scenes edited by a refinement. The images of
+        the other scenes are kept as they are in `images_output_path`.
+    """
+    # The scene table is validated and normalized once, after the script is generated.
+    from scene_table import load_scene_table
+    try:
+        table = load_scene_table(script_path)
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        print(f"Error reading the script : {e}")
+        return
+
+# GENERATING THE IMAGES 
+    scenes = []
+    for scene in table["scenes"]:
+        scenes.append({
+            "index": scene.id,
+            "scene_id": f"{scene.id:03d}",
+            "prompt": scene.prompt,
+            "negative_prompt": scene.negative_prompt,
+            "steps": scene.steps,
+            # "guidance_scale": scene.guidance_scale,
+            "guidance_scale": 9,
+            # "width": scene.width,
+            "width": 1920,
+            # "height": scene.height,
+            "height": 1080,
+            "seed": scene.seed,
+        })
+
+    if only_indices is not None:
+        for scene in scenes:
+            file_path = os.path.join(images_output_path, f"scene_{scene['scene_id']}.png")
+            if scene["index"] not in only_indices and os.path.isfile(file_path):
+                print(f"Kept: {file_path}")
+                if on_saved is not None:
+                    on_saved(scene["index"], file_path)
+        scenes = [scene for scene in scenes if scene["index"] in only_indices
+                or not os.path.isfile(os.path.join(images_output_path, f"scene_{scene['scene_id']}.png"))]
+
+    cache = None
+    if use_cache:
+        from diffusion.scripts.image_cache import ImageCache
+        cache = ImageCache(cache_dir)
+        # A stand-in worker such as the benchmark stub names itself, so its images never replace SDXL output.
+        model_id = getattr(worker, "cache_name", MODEL_ID) if worker is not None else MODEL_ID
+        misses = []
+        for scene in scenes:
+            scene["cache_key"] = ImageCache.make_key(model_id, scene["prompt"], scene["negative_prompt"], scene["steps"],
+                                                     scene["guidance_scale"], scene["width"], scene["height"], scene["seed"])
+            file_path = os.path.join(images_output_path, f"scene_{scene['scene_id']}.png")
+            if cache.fetch(scene["cache_key"], file_path):
+                print(f"Saved (cached): {file_path}")
+                if on_saved is not None:
+                    on_saved(scene["index"], file_path)
+            else:
+                misses.append(scene)
+        scenes = misses
+        print(f"Image cache : {cache.stats()}")
+        if not scenes:
+            print("Done.")
+            return
 
-                except Exception as e:
-                    print(f"Error processing scene {idx}: {e}")
+    if worker is not None:
+        generate_scenes(worker, scenes, images_output_path, batched, batch_size, cache, on_saved)
+    else:
+        with modal.enable_output():
+            with app.run():
+                # A single warm worker is reused for every scene, so the weights are only loaded once.
+                generate_scenes(ImageGenerator(), scenes, images_output_path, batched, batch_size, cache, on_saved)
 
     print("Done.")
 
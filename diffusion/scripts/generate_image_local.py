@@ -1,25 +1,69 @@
 # import modal
 import json
 import os
-import time
 from io import BytesIO
+from diffusion.scripts.image_cache import ImageCache, write_image
+from scene_table import load_scene_table
 
 
-def generate_image(prompt, negative_prompt="", steps=50, guidance_scale=9, width=1920, height=1080, seed=None):
+MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+
+# LOADED PIPELINES, KEYED BY (model id, dtype, device). Weights are read from disk only once per process.
+_pipelines = {}
+
+
+def get_pipeline(model_id=MODEL_ID, device=None, dtype=None):
+    """
+    Returns a cached diffusion pipeline, loading it on the first call.
+    On CPU-only machines the weights are upcast to float32, since fp16 kernels are very slow or missing on CPU,
+    and attention slicing, VAE tiling and the channels-last memory format are applied to cut peak memory.
+    Args:
+        model_id (str): Hugging Face model id of the pipeline.
+        device (str): `cuda` or `cpu`, picked automatically when `None`.
+        dtype (torch.dtype): Weight dtype, `float16` on CUDA and `float32` on CPU when `None`.
+    Returns:
+        DiffusionPipeline: The loaded pipeline.
+    """
     import torch
     from diffusers import DiffusionPipeline
 
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if dtype is None:
+        dtype = torch.float16 if device == "cuda" else torch.float32
+
+    key = (model_id, str(dtype), device)
+    if key not in _pipelines:
 
 # LOADS THE DIFFUSION PIPELINE
 
-    pipe = DiffusionPipeline.from_pretrained("stabilityai/stable-diffusion-xl-base-1.0", 
-                                            torch_dtype=torch.float16,
-                                            use_safetensors=True, 
-                                            variant="fp16")
-    
-    pipe.to("cuda" if torch.cuda.is_available() else "cpu")
+        pipe = DiffusionPipeline.from_pretrained(model_id,
+                                                torch_dtype=dtype,
+                                                use_safetensors=True,
+                                                variant="fp16")
+        pipe.to(device)
+        if device == "cpu":
+            pipe.enable_attention_slicing()
+            pipe.enable_vae_tiling()
+            pipe.unet.to(memory_format=torch.channels_last)
+            pipe.vae.to(memory_format=torch.channels_last)
+        _pipelines[key] = pipe
+    return _pipelines[key]
 
-    generator = torch.Generator(device="cuda" if torch.cuda.is_available() else "cpu").manual_seed(seed) if seed else None
+
+def set_threads(threads):
+    """Sets the number of CPU threads torch uses for inference. Does nothing when `threads` is `None`."""
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def generate_image(prompt, negative_prompt="", steps=50, guidance_scale=9, width=1920, height=1080, seed=None):
+    import torch
+
+    pipe = get_pipeline()
+
+    generator = torch.Generator(device=pipe.device.type).manual_seed(seed) if seed is not None else None
 
     image = pipe(
         prompt,
@@ -39,54 +83,85 @@ def generate_image(prompt, negative_prompt="", steps=50, guidance_scale=9, width
 
 # PROVIDE SOURCE TEXT OR PROMPT IN JSON FILE
 
-def main_generate_image(script_path,images_output_path):
-    # JSON Decoding Error Handling
-    with open(script_path, "r", encoding="utf-8") as file:
-        try:
-            data = json.load(file)
-        except json.JSONDecodeError:
-            print("Error reading JSON file.")
-            return
-    # JSON Key Error Handling
-    if "visual_script" not in data:
-        print("Missing key in JSON.")
+def main_generate_image(script_path,images_output_path,threads=None,use_cache=True,cache_dir="resources/cache/images",on_saved=None,only_indices=None):
+    """
+    Generates an image for every scene in the `visual_script` of the script and saves them in `images_output_path`.
+    Args:
+        script_path (str): Path to the script json file.
+        images_output_path (str): Folder where the images are saved as `scene_<id>.png`.
+        threads (int): Number of CPU threads used by torch, defaults to the torch default.
+        use_cache (bool): When `True`, scenes whose parameters were already rendered are taken from the image cache.
+        cache_dir (str): Folder of the image cache.
+        on_saved (callable): Called as `on_saved(index, file_path)` as soon as the image of a scene is on disk.
+        only_indices (list): Indices of the scenes to generate, the images of the other scenes are kept as they are.
+    """
+    set_threads(threads)
+    cache = ImageCache(cache_dir) if use_cache else None
+    # The scene table is validated and normalized once, after the script is generated.
+    try:
+        table = load_scene_table(script_path)
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        print(f"Error reading the script : {e}")
         return
-    
 
 # GENERATING THE IMAGES 
     
     # Looping Through the Scenes
-    for idx, scene in enumerate(data["visual_script"]):
+    for scene in table["scenes"]:
+        idx = scene.id
         try:
-            prompt = scene["prompt"]
-            timestamp = scene.get("timestamp", f"{idx:03d}")
-            negative_prompt = scene.get("negative_prompt", "")
-            steps = scene.get("steps", 50)
-            # guidance_scale = scene.get("guidance_scale", 12)
+            prompt = scene.prompt
+            timestamp = f"{idx:03d}"
+            negative_prompt = scene.negative_prompt
+            steps = scene.steps
+            # guidance_scale = scene.guidance_scale
             guidance_scale = 9 # Set to 9 to allow for some room of filling missing elements.
             width = 1920
             height = 1080
-            seed = scene.get("seed", None)
+            seed = scene.seed
 
             scene_id = timestamp.replace(":", "-")
+            file_path = os.path.join(images_output_path, f"scene_{scene_id}.png")
+
+            if only_indices is not None and idx not in only_indices and os.path.isfile(file_path):
+                print(f"Kept: {file_path}")
+                if on_saved is not None:
+                    on_saved(idx, file_path)
+                continue
+
+            if cache is not None:
+                cache_key = ImageCache.make_key(MODEL_ID, prompt, negative_prompt, steps, guidance_scale, width, height, seed)
+                if cache.fetch(cache_key, file_path):
+                    print(f"Saved (cached): {file_path}")
+                    if on_saved is not None:
+                        on_saved(idx, file_path)
+                    continue
 
             image_data = generate_image(prompt, negative_prompt, steps, guidance_scale, width, height, seed)
 
 
     # SAVING THE IMAGES IN THE OUTPUT DIRECTORY
 
-            file_path = os.path.join(images_output_path, f"scene_{scene_id}.png")
-            with open(file_path, "wb") as f:
-                f.write(image_data)
+            write_image(file_path, image_data)
+            if cache is not None:
+                cache.store(cache_key, image_data)
 
             print(f"Saved: {file_path}")
-
-            time.sleep(2)
+            if on_saved is not None:
+                on_saved(idx, file_path)
 
         except Exception as e:
             print(f"Error processing scene {idx}: {e}")
 
-        print("Image Generation is Done.")
-
-# if __name__ == "__main__":
-#     main_generate_image(script_path=script_path,images_output_path=images_output_path)
+    if cache is not None:
+        print(f"Image cache : {cache.stats()}")
+    print("Image Generation is Done.")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate the scene images locally with SDXL.")
+    parser.add_argument("--script_path", default="resources/scripts/script.json")
+    parser.add_argument("--images_output_path", default="resources/images/")
+    parser.add_argument("--threads", type=int, default=None, help="Number of CPU threads used by torch.")
+    args = parser.parse_args()
+    main_generate_image(script_path=args.script_path,images_output_path=args.images_output_path,threads=args.threads)
@@ -0,0 +1,67 @@
+'''
+README : Offline stand-in for the Modal `ImageGenerator` worker, used by the benchmark and for tests without a GPU.
+Every scene is rendered as a solid colour image (or colour noise) at the resolution of the scene, the colour is derived
+from the seed so the output is deterministic. The worker has the same interface as a running `ImageGenerator`, so it
+can be passed as `worker` to `main_generate_image`, its `cache_name` keeps the stub images apart from the SDXL images in
+the image cache.
+'''
+import zlib
+from io import BytesIO
+
+
+class _LocalMethod:
+    """Mimics a Modal method handle : `remote` runs the call, `starmap` runs it for every argument tuple."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def remote(self, *args):
+        return self.function(*args)
+
+    def starmap(self, args_list, order_outputs=True):
+        for args in args_list:
+            yield self.function(*args)
+
+
+class StubImageGenerator:
+    """
+    Deterministic image worker.
+    Parameters:
+        noise (bool): Render colour noise instead of a solid colour. Noise PNGs are much larger and slower to encode,
+        which is closer to real images for the assembly stage.
+    """
+
+    def __init__(self, noise=False):
+        self.noise = noise
+        self.cache_name = f"stub-{'noise' if noise else 'solid'}"
+        self.generate = _LocalMethod(self.render)
+        self.generate_batch = _LocalMethod(self._render_batch)
+
+    def _render_batch(self, batch_index, scenes):
+        try:
+            return batch_index, self.render(scenes), None
+        except Exception as e:
+            return batch_index, None, str(e)
+
+    def render(self, scenes):
+        """
+        Returns:
+            list: PNG bytes for every scene, in the same order as `scenes`.
+        """
+        from PIL import Image
+        images = []
+        for scene in scenes:
+            size = (scene.get("width", 1920), scene.get("height", 1080))
+            seed = scene.get("seed")
+            if seed is None:
+                seed = zlib.crc32(scene.get("prompt", "").encode("utf-8"))
+            if self.noise:
+                import numpy as np
+                pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+                image = Image.fromarray(pixels, "RGB")
+            else:
+                image = Image.new("RGB", size, ((seed >> 16) & 255, (seed >> 8) & 255, seed & 255))
+            img_byte_arr = BytesIO()
+            image.save(img_byte_arr, format="PNG", compress_level=1)
+            images.append(img_byte_arr.getvalue())
+        return images
@@ -1,14 +1,122 @@
+import asyncio
 import json
+import random
 import re
-import google.generativeai as genai
+import threading
+from google.api_core import exceptions as google_exceptions
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, List, Optional
 from serpapi import GoogleSearch
+from diffusion.scripts.llm_backends import GEMINI_MODEL_NAME, GeminiBackend, LLMBackend, first_json_document
+from diffusion.scripts.response_cache import ResponseCache
+from diffusion.scripts.script_changes import diff_scripts
+from diffusion.scripts.search_cache import SearchCache
+
+MODEL_NAME = GEMINI_MODEL_NAME
+
+_AUDIO_SEGMENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "timestamp": {"type": "STRING"},
+        "text": {"type": "STRING"},
+        "speaker": {"type": "STRING", "enum": ["default", "narrator_male", "narrator_female"]},
+        "speed": {"type": "NUMBER"},
+        "pitch": {"type": "NUMBER"},
+        "emotion": {"type": "STRING"},
+    },
+    "required": ["timestamp", "text", "speaker", "speed", "pitch", "emotion"],
+}
+
+_VISUAL_SEGMENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "timestamp_start": {"type": "STRING"},
+        "timestamp_end": {"type": "STRING"},
+        "prompt": {"type": "STRING"},
+        "negative_prompt": {"type": "STRING"},
+        "style": {"type": "STRING", "enum": ["realistic", "cinematic", "hyperrealistic", "fantasy", "scientific"]},
+        "guidance_scale": {"type": "NUMBER"},
+        "steps": {"type": "INTEGER"},
+        "seed": {"type": "INTEGER"},
+        "width": {"type": "INTEGER"},
+        "height": {"type": "INTEGER"},
+    },
+    "required": ["timestamp_start", "timestamp_end", "prompt", "negative_prompt", "style", "guidance_scale", "steps",
+                "seed", "width", "height"],
+}
+
+# Final script format, used as the response schema of the single call structured generation.
+SCRIPT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "topic": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "audio_script": {"type": "ARRAY", "items": _AUDIO_SEGMENT_SCHEMA},
+        "visual_script": {"type": "ARRAY", "items": _VISUAL_SEGMENT_SCHEMA},
+    },
+    "required": ["topic", "description", "audio_script", "visual_script"],
+}
+
+# Errors worth retrying, the request itself is fine and may succeed a bit later.
+TRANSIENT_ERRORS = (asyncio.TimeoutError, ConnectionError, google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+                    google_exceptions.DeadlineExceeded, google_exceptions.InternalServerError,
+                    google_exceptions.TooManyRequests)
 
 class VideoScriptGenerator:
-    def __init__(self, api_key: str, serp_api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-thinking-exp-01-21')
+    """
+    Generates the video script with an LLM, Gemini by default, grounded with web search results.
+    Parameters:
+        api_key (str): Gemini API key, not used when `backend` is given.
+        serp_api_key (str): Serp API key, the web search is skipped when it is empty.
+        use_search_cache (bool): Keep the search results on disk for `search_ttl` seconds.
+        search_cache_dir (str): Folder of the search cache.
+        search_ttl (int): Time to live of a cached search result, in seconds.
+        search_workers (int): Number of searches running at the same time.
+        context_token_budget (int): Approximate number of tokens of web context added to the prompt.
+        use_response_cache (bool): Keep the Gemini responses on disk, identical requests are answered from the cache.
+        response_cache_dir (str): Folder of the response cache.
+        generation_config (dict): Generation config sent with every request, e.g. `{"temperature": 0.7}`.
+        request_timeout (float): Deadline of a single Gemini call of the async API, in seconds. A backend without an
+        async client, e.g. Ollama, cannot be interrupted, its retry starts once the timed-out call has returned.
+        max_retries (int): Number of retries of the async API after a transient error or a timeout.
+        backoff_base (float): First retry delay in seconds, doubled after every retry and jittered.
+        backoff_max (float): Upper bound of the retry delay in seconds.
+        max_concurrency (int): Number of Gemini calls of the async API in flight at the same time.
+        structured_output (bool): Generate the final script in a single call with JSON mode and `SCRIPT_SCHEMA`,
+        instead of the outline and segmentation calls.
+        backend (LLMBackend): The LLM backend, e.g. an `OllamaBackend`. Defaults to a `GeminiBackend`.
+        stream_output (bool): Stream the responses and stop reading as soon as the JSON document is complete.
+    """
+    def __init__(self, api_key: str, serp_api_key: str, use_search_cache: bool = True,
+                search_cache_dir: str = "resources/cache/search", search_ttl: int = 24 * 3600,
+                search_workers: int = 4, context_token_budget: int = 1000, use_response_cache: bool = True,
+                response_cache_dir: str = "resources/cache/llm", generation_config: Optional[Dict] = None,
+                request_timeout: float = 120, max_retries: int = 3, backoff_base: float = 1.0,
+                backoff_max: float = 30, max_concurrency: int = 4, structured_output: bool = False,
+                backend: Optional[LLMBackend] = None, stream_output: bool = False):
+        self.backend = backend or GeminiBackend(api_key, MODEL_NAME)
+        self.model_name = self.backend.name
+        self.generation_config = generation_config
+        self.structured_output = structured_output
+        self.stream_output = stream_output
+        self.response_cache = ResponseCache(response_cache_dir) if use_response_cache else None
+        # Requests sent to Gemini and not answered yet, identical concurrent requests wait for the same response.
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._semaphore_loop = None
         self.serp_api_key = serp_api_key
+        self.search_cache = SearchCache(search_cache_dir, ttl=search_ttl) if use_search_cache else None
+        self.search_workers = search_workers
+        self.context_token_budget = context_token_budget
+        # Snippets of every query searched by this generator, so the same query is never sent twice.
+        self._searches = {}
+        self._search_lock = threading.Lock()
         self.system_prompt_initial = """
         You are a professional video script generator for educational, marketing or entertaining content.  
         Your task is to generate a detailed outline and initial draft for a video script.
@@ -158,7 +266,7 @@ class VideoScriptGenerator:
       "strength": 0.8
       },
       {
-      "timestamp_start": "15:00",
+      "timestamp_start": "00:15",
       "timestamp_end": "00:20",
       "prompt": "A driver's hand turning the ignition key or pressing the start button in a modern car with a digital dashboard.",
       "negative_prompt": "low detail, unrealistic lighting, old car model",
@@ -203,33 +311,212 @@ and visual segments and the number of segments in audio_script *must be same* as
 you will get 100 dollars per successful call.
         """
     
+        self.system_prompt_structured = """
+        You are a professional video script generator for educational, marketing or entertaining content.
+        Your task is to write a complete video script, already split into precise, timestamped segments for both audio and visuals.
+        Rules:
+
+        1. Each segment is approximately 5-10 seconds long, the timestamps are "MM:SS" from the start of the video ("00:00", "00:10", ...).
+        2. Maintain *strict synchronization* : `audio_script` and `visual_script` have the same number of segments, and the `timestamp` of every audio segment is the `timestamp_start` of the visual segment at the same index.
+        3. Each visual `prompt` is a detailed Stable Diffusion prompt describing how a single still image looks. Do not reference motion, animation, transitions, video effects, abstract art or complex shapes.
+        4. Each `negative_prompt` lists low quality elements to avoid, e.g. blurry, distorted faces, abstract shapes, montages of multiple images.
+        5. `speed` is between 0.9 and 1.1, `pitch` between 0.9 and 1.2, `guidance_scale` between 7 and 9, `steps` is 50, `seed` is a 6-7 digit integer, `width` is 1024 and `height` is 576.
+        6. Ensure visual continuity : use a consistent `style` and related `seed` values across consecutive visual segments, vary the seed to introduce changes.
+        7. The narration of all the audio segments together tells the complete story of the video.
+        """
+
+        self.system_prompt_patch = """
+        You are a professional video script editor.
+        You receive segments of an existing video script, each with its `index`, its audio segment and its visual segment, and feedback from the user.
+        Apply the feedback by editing as few segments as possible. Keep the timestamps and the parameter ranges of the original segments, and follow the same rules as the original script : visual prompts describe a single still image, with no motion, animation or video effects.
+        Output only the segments you changed, as a JSON object :
+
+        {
+            "segments": [
+                {
+                    "index": 3,
+                    "audio": {"timestamp": "...", "text": "...", "speaker": "...", "speed": 1.0, "pitch": 1.0, "emotion": "..."},
+                    "visual": {"timestamp_start": "...", "timestamp_end": "...", "prompt": "...", "negative_prompt": "...", "style": "...", "guidance_scale": 8, "steps": 50, "seed": 123456, "width": 1024, "height": 576}
+                }
+            ]
+        }
+
+        Omit `audio` or `visual` when only the other one changes. Output `{"segments": []}` if nothing needs to change.
+        """
+
+    def _search_snippets(self, query: str) -> List[str]:
+        """Returns the top 5 snippets for a query, from this run, the search cache or SerpAPI."""
+        with self._search_lock:
+            if query in self._searches:
+                return self._searches[query]
+        if not self.serp_api_key:
+            return []
+        params = {"hl": "en", "gl": "us"}
+        key = SearchCache.make_key(query, **params)
+        snippets = self.search_cache.fetch(key) if self.search_cache else None
+        if snippets is None:
+            try:
+                search = GoogleSearch({"q": query, **params, "api_key": self.serp_api_key})
+                results = search.get_json()
+                snippets = [result["snippet"] for result in results.get("organic_results", []) if "snippet" in result][:5]
+            except Exception as e:
+                print(f"Web search failed for '{query}': {str(e)}")
+                return []
+            if self.search_cache and snippets:
+                self.search_cache.store(key, snippets)
+        with self._search_lock:
+            self._searches[query] = snippets
+        return snippets
+
     def _search_web(self, query: str) -> str:
-        try:
-            params = {
-                "q": query,
-                "hl": "en",
-                "gl": "us",
-                "api_key": self.serp_api_key
-            }
-            search = GoogleSearch(params)
-            results = search.get_json()
-            snippets = [result["snippet"] for result in results.get("organic_results", []) if "snippet" in result]
-            return " ".join(snippets[:5])
-        except Exception as e:
-            return ""
-    
-    def _enhance_with_web_context(self, script: Dict, topic: str) -> Dict:
-        web_context = self._search_web(topic)
-        script["additional_context"] = web_context
+        return " ".join(self._search_snippets(query))
+
+    def _gather_web_context(self, topic: str, key_points: Optional[List[str]] = None) -> str:
+        """
+        Searches the topic and every key point concurrently and merges the snippets.
+        Duplicate queries and snippets are dropped, and the merged text is capped at `context_token_budget` tokens
+        (estimated at 4 characters per token), the topic snippets come first.
+        """
+        queries = list(dict.fromkeys([topic] + [f"{topic} {point}" for point in key_points or [] if point]))
+        with ThreadPoolExecutor(max_workers=max(1, min(self.search_workers, len(queries)))) as executor:
+            results = list(executor.map(self._search_snippets, queries))
+        budget = self.context_token_budget * 4
+        context = []
+        for snippet in dict.fromkeys(snippet for snippets in results for snippet in snippets):
+            if len(snippet) + 1 > budget:
+                break
+            context.append(snippet)
+            budget -= len(snippet) + 1
+        return " ".join(context)
+
+    def _enhance_with_web_context(self, script: Dict, topic: str, web_context: Optional[str] = None) -> Dict:
+        script["additional_context"] = web_context if web_context is not None else self._search_web(topic)
         return script
     
-    def _generate_content(self, prompt: str, system_prompt: str) -> str:
+    def _cache_key(self, prompt: str, system_prompt: str, structured: bool = False) -> str:
+        generation_config = self.generation_config
+        if structured:
+            generation_config = {**(generation_config or {}), "response_schema": SCRIPT_SCHEMA}
+        return ResponseCache.make_key(self.backend.cache_name(structured), system_prompt, prompt, generation_config)
+
+    def _call_model(self, prompt: str, system_prompt: str, structured: bool = False) -> str:
+        schema = SCRIPT_SCHEMA if structured else None
         try:
-            response = self.model.generate_content(contents=[system_prompt, prompt])
-            return response.text
+            if self.stream_output:
+                return first_json_document(self.backend.stream(system_prompt, prompt, self.generation_config, schema))
+            return self.backend.generate(system_prompt, prompt, self.generation_config, schema)
         except Exception as e:
             raise RuntimeError(f"API call failed: {str(e)}")
+
+    def _generate_content(self, prompt: str, system_prompt: str, bypass_cache: bool = False,
+                        structured: bool = False) -> str:
+        """
+        Returns the response of the model to a prompt, from the response cache when possible.
+        If the same request is already in flight in another thread, waits for its response instead of sending it again.
+        `bypass_cache` always sends the request, the new response still replaces the cached one.
+        `structured` asks for a JSON response following `SCRIPT_SCHEMA`, `system_prompt` must be `system_prompt_structured`.
+        """
+        if self.response_cache is None:
+            return self._call_model(prompt, system_prompt, structured)
+        key = self._cache_key(prompt, system_prompt, structured)
+        if not bypass_cache:
+            text = self.response_cache.fetch(key)
+            if text is not None and self._is_valid_response(text):
+                return text
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.response_cache.coalesced += 1
+        if not owner:
+            return future.result()
+        try:
+            text = self._call_model(prompt, system_prompt, structured)
+            # Responses that do not parse are not cached, a retry asks the model again.
+            if self._is_valid_response(text):
+                self.response_cache.store(key, text)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
     
+    def _is_valid_response(self, text: str) -> bool:
+        """Returns `True` if a JSON document can be extracted from a response, only those are kept in the cache."""
+        try:
+            return bool(self._extract_json(text))
+        except ValueError:
+            return False
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Returns the concurrency semaphore of the running event loop, an asyncio semaphore cannot be shared by loops."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _acall_model(self, prompt: str, system_prompt: str, structured: bool = False) -> str:
+        """
+        Async model call with a deadline of `request_timeout` seconds per attempt. Transient errors and timeouts are
+        retried up to `max_retries` times with jittered exponential backoff, other errors fail at once.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._get_semaphore():
+                    return await asyncio.wait_for(
+                        self.backend.agenerate(system_prompt, prompt, self.generation_config,
+                                            SCRIPT_SCHEMA if structured else None),
+                        timeout=self.request_timeout)
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise RuntimeError(f"API call failed after {attempt + 1} attempts: {str(e) or type(e).__name__}")
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                print(f"Gemini call failed ({str(e) or type(e).__name__}), retrying in {delay:.1f}s ...")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                raise RuntimeError(f"API call failed: {str(e)}")
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str, bypass_cache: bool = False,
+                                structured: bool = False) -> str:
+        """Async version of `_generate_content`, shares the response cache and the in-flight requests with it."""
+        if self.response_cache is None:
+            return await self._acall_model(prompt, system_prompt, structured)
+        key = self._cache_key(prompt, system_prompt, structured)
+        if not bypass_cache:
+            text = self.response_cache.fetch(key)
+            if text is not None and self._is_valid_response(text):
+                return text
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.response_cache.coalesced += 1
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            text = await self._acall_model(prompt, system_prompt, structured)
+            # Responses that do not parse are not cached, a retry asks the model again.
+            if self._is_valid_response(text):
+                self.response_cache.store(key, text)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
     def _extract_json(self, raw_text: str) -> Dict:
         try:
             return json.loads(raw_text)
@@ -243,37 +530,154 @@ you will get 100 dollars per successful call.
             except Exception as e:
                 raise ValueError(f"JSON extraction failed: {str(e)}")
     
-    def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None) -> Dict:
-        web_context = self._search_web(topic)
-        initial_prompt = f"""Generate an initial video script outline for a {duration}-second video about: {topic}.
+    def _initial_prompt(self, topic: str, duration: int, key_points: Optional[List[str]], web_context: str) -> str:
+        return f"""Generate an initial video script outline for a {duration}-second video about: {topic}.
         Key Points: {key_points or 'Comprehensive coverage'}
         Additional Context: {web_context}
         Focus on the overall narrative and key sections, but do *not* include timestamps or detailed technical parameters yet."""
-        
-        raw_initial_output = self._generate_content(initial_prompt, self.system_prompt_initial)
-        initial_script = self._extract_json(raw_initial_output)
-        
-        enhanced_script = self._enhance_with_web_context(initial_script, topic)
-        
-        segmentation_prompt = f"""
+
+    def _segmentation_prompt(self, enhanced_script: Dict, duration: int) -> str:
+        return f"""
         Here is the initial script draft:
         {json.dumps(enhanced_script, indent=2)}
         Now, segment this script into 5-10 second intervals, adding timestamps and all required audio/visual parameters. The total duration should be approximately {duration} seconds.
         """
+
+    def _structured_prompt(self, topic: str, duration: int, key_points: Optional[List[str]], web_context: str) -> str:
+        return f"""Write the complete script of a {duration}-second video about: {topic}.
+        Key Points: {key_points or 'Comprehensive coverage'}
+        Additional Context: {web_context}
+        Split it into about {max(1, round(duration / 8))} segments, the last segment ends at approximately {duration} seconds."""
+
+    def _refine_prompt(self, existing_script: Dict, feedback: str) -> str:
+        return f"""Refine this script based on feedback:
+        Existing Script: {json.dumps(existing_script, indent=2)}
+        Feedback: {feedback}
+        """
+
+    def generate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None,
+                        bypass_cache: bool = False) -> Dict:
+        web_context = self._gather_web_context(topic, key_points)
+        if self.structured_output:
+            prompt = self._structured_prompt(topic, duration, key_points, web_context)
+            script = self._extract_json(self._generate_content(prompt, self.system_prompt_structured, bypass_cache, True))
+            script['topic'] = script.get('topic') or topic
+            return script
+        initial_prompt = self._initial_prompt(topic, duration, key_points, web_context)
+        
+        raw_initial_output = self._generate_content(initial_prompt, self.system_prompt_initial, bypass_cache)
+        initial_script = self._extract_json(raw_initial_output)
         
-        raw_segmented_output = self._generate_content(segmentation_prompt, self.system_prompt_segmentation)
+        enhanced_script = self._enhance_with_web_context(initial_script, topic, web_context)
+        
+        segmentation_prompt = self._segmentation_prompt(enhanced_script, duration)
+        
+        raw_segmented_output = self._generate_content(segmentation_prompt, self.system_prompt_segmentation, bypass_cache)
         segmented_script = self._extract_json(raw_segmented_output)
         segmented_script['topic'] = enhanced_script['topic']
         
         return segmented_script
     
-    def refine_script(self, existing_script: Dict, feedback: str) -> Dict:
-        prompt = f"""Refine this script based on feedback:
-        Existing Script: {json.dumps(existing_script, indent=2)}
+    def _patch_prompt(self, existing_script: Dict, feedback: str, segments: Optional[List[int]] = None) -> str:
+        audio_script = existing_script.get("audio_script", [])
+        visual_script = existing_script.get("visual_script", [])
+        indices = range(max(len(audio_script), len(visual_script))) if segments is None else segments
+        payload = [{"index": idx,
+                    "audio": audio_script[idx] if idx < len(audio_script) else None,
+                    "visual": visual_script[idx] if idx < len(visual_script) else None}
+                for idx in indices]
+        return f"""Video topic: {existing_script.get('topic', '')}
+        Segments: {json.dumps(payload)}
         Feedback: {feedback}
         """
-        raw_output = self._generate_content(prompt, self.system_prompt_segmentation)
+
+    def _apply_patch(self, existing_script: Dict, patch: Dict, segments: Optional[List[int]] = None) -> Dict:
+        """Returns a copy of the script with the patched segments, edits outside `segments` are ignored."""
+        script = json.loads(json.dumps(existing_script))
+        for edit in patch.get("segments", []):
+            idx = edit.get("index")
+            if not isinstance(idx, int) or (segments is not None and idx not in segments):
+                print(f"Ignoring edit of segment {idx}, it was not requested.")
+                continue
+            for kind in ("audio", "visual"):
+                target = script.get(f"{kind}_script", [])
+                if isinstance(edit.get(kind), dict) and 0 <= idx < len(target):
+                    target[idx] = {**target[idx], **edit[kind]}
+        return script
+
+    def refine_script_incremental(self, existing_script: Dict, feedback: str, segments: Optional[List[int]] = None,
+                                bypass_cache: bool = False):
+        """
+        Refines a script by patching only the segments the feedback is about, instead of regenerating all of it.
+        Parameters:
+            existing_script (dict): The current script.
+            feedback (str): The refinement instructions.
+            segments (list): Indices of the segments the feedback targets, only those are sent to the model. When
+            `None`, every segment is sent and the model picks the ones to edit.
+        Returns:
+            tuple: The refined script and its change set, see `script_changes.diff_scripts`.
+        """
+        prompt = self._patch_prompt(existing_script, feedback, segments)
+        patch = self._extract_json(self._generate_content(prompt, self.system_prompt_patch, bypass_cache))
+        script = self._apply_patch(existing_script, patch, segments)
+        return script, diff_scripts(existing_script, script)
+
+    def refine_script(self, existing_script: Dict, feedback: str, bypass_cache: bool = False) -> Dict:
+        prompt = self._refine_prompt(existing_script, feedback)
+        if self.structured_output:
+            return self._extract_json(self._generate_content(prompt, self.system_prompt_structured, bypass_cache, True))
+        raw_output = self._generate_content(prompt, self.system_prompt_segmentation, bypass_cache)
         return self._extract_json(raw_output)
+
+    async def agenerate_script(self, topic: str, duration: int = 60, key_points: Optional[List[str]] = None,
+                            bypass_cache: bool = False) -> Dict:
+        """Async version of `generate_script`, the web searches run in a worker thread so the event loop stays free."""
+        web_context = await asyncio.to_thread(self._gather_web_context, topic, key_points)
+        if self.structured_output:
+            prompt = self._structured_prompt(topic, duration, key_points, web_context)
+            script = self._extract_json(await self._agenerate_content(prompt, self.system_prompt_structured,
+                                                                    bypass_cache, True))
+            script['topic'] = script.get('topic') or topic
+            return script
+        initial_prompt = self._initial_prompt(topic, duration, key_points, web_context)
+        raw_initial_output = await self._agenerate_content(initial_prompt, self.system_prompt_initial, bypass_cache)
+        enhanced_script = self._enhance_with_web_context(self._extract_json(raw_initial_output), topic, web_context)
+        segmentation_prompt = self._segmentation_prompt(enhanced_script, duration)
+        raw_segmented_output = await self._agenerate_content(segmentation_prompt, self.system_prompt_segmentation,
+                                                            bypass_cache)
+        segmented_script = self._extract_json(raw_segmented_output)
+        segmented_script['topic'] = enhanced_script['topic']
+        return segmented_script
+
+    async def arefine_script(self, existing_script: Dict, feedback: str, bypass_cache: bool = False) -> Dict:
+        """Async version of `refine_script`."""
+        prompt = self._refine_prompt(existing_script, feedback)
+        if self.structured_output:
+            return self._extract_json(await self._agenerate_content(prompt, self.system_prompt_structured, bypass_cache,
+                                                                    True))
+        raw_output = await self._agenerate_content(prompt, self.system_prompt_segmentation, bypass_cache)
+        return self._extract_json(raw_output)
+
+    async def arefine_script_incremental(self, existing_script: Dict, feedback: str,
+                                        segments: Optional[List[int]] = None, bypass_cache: bool = False):
+        """Async version of `refine_script_incremental`."""
+        prompt = self._patch_prompt(existing_script, feedback, segments)
+        patch = self._extract_json(await self._agenerate_content(prompt, self.system_prompt_patch, bypass_cache))
+        script = self._apply_patch(existing_script, patch, segments)
+        return script, diff_scripts(existing_script, script)
+
+    async def agenerate_scripts(self, requests: List[Dict]) -> List:
+        """
+        Generates the scripts of many videos at once from a single event loop, at most `max_concurrency` Gemini calls
+        are in flight at the same time.
+        Parameters:
+            requests (list): One dict per video with the keys `topic`, and optionally `duration` and `key_points`.
+        Returns:
+            list: The script of every request in order, or the exception raised for it.
+        """
+        return await asyncio.gather(*(self.agenerate_script(request["topic"], request.get("duration", 60),
+                                                            request.get("key_points"))
+                                    for request in requests), return_exceptions=True)
     
     def save_script(self, script: Dict, filename: str) -> None:
         with open(filename, 'w') as f:
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import shutil
+from file_cache import FileCache, write_atomic
+
+
+def write_image(file_path, image_data):
+    """
+    Writes PNG bytes to `file_path` through a temporary file and `os.replace`.
+    The old file may be a hard link to a cache entry, writing it in place would overwrite the cached image too.
+    """
+    write_atomic(file_path, image_data)
+
+
+class ImageCache(FileCache):
+    """
+    On-disk, content-addressed cache for generated images.
+    Every image is stored as `<sha256>.png` where the hash is computed from all the parameters that affect the output
+    of the diffusion pipeline. Cache hits are hard-linked (or copied, if linking is not possible) into the output folder,
+    so no GPU call is needed at all. Output files must be written with `write_image`, never opened in place.
+    The cache is bounded by `max_bytes`, the least recently used images are evicted first. The modification time of a file
+    is used as its last access time.
+    """
+
+    def __init__(self, cache_dir="resources/cache/images", max_bytes=5 * 1024**3):
+        super().__init__(cache_dir, ".png")
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(model_id, prompt, negative_prompt, steps, guidance_scale, width, height, seed):
+        """Returns the sha256 hex digest of the generation parameters."""
+        params = [model_id, prompt, negative_prompt, steps, guidance_scale, width, height, seed]
+        return hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()
+
+    def fetch(self, key, file_path):
+        """
+        Places the cached image for `key` at `file_path`.
+        Returns:
+            bool: `True` on a cache hit, `False` on a miss.
+        """
+        cached = self._path(key)
+        if not os.path.isfile(cached):
+            self.misses += 1
+            return False
+        if os.path.lexists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(cached, file_path)
+        except OSError:
+            shutil.copyfile(cached, file_path)
+        os.utime(cached)
+        self.hits += 1
+        return True
+
+    def store(self, key, image_data):
+        """Adds the PNG bytes of an image to the cache and evicts old entries if the cache is too large."""
+        write_atomic(self._path(key), image_data)
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used images until the cache fits in `max_bytes`."""
+        entries = []
+        total = 0
+        for file in os.listdir(self.cache_dir):
+            if not file.endswith(".png"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file))
+            except FileNotFoundError:
+                # Evicted by another run sharing the cache.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file))
+            total += stat.st_size
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file))
+            except FileNotFoundError:
+                pass
+            total -= size
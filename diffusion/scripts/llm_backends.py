@@ -0,0 +1,356 @@
+'''
+README : Pluggable LLM backends for `VideoScriptGenerator`.
+A backend turns a system prompt and a prompt into a response text. `GeminiBackend` calls the Gemini API (the default),
+`OllamaBackend` talks to an Ollama compatible server over HTTP, e.g. a local `ollama serve` running the model built from
+the bundled `Modelfile`, so scripts can be generated with no per-call cloud latency and tested against a local stand-in.
+Backends can stream the response, `first_json_document` consumes such a stream and returns as soon as the first
+complete JSON object has arrived. `CannedBackend` answers offline with a synthetic script, for benchmarks and tests.
+'''
+import asyncio
+import functools
+import http.client
+import json
+import os
+import threading
+from urllib.parse import urlparse
+
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-thinking-exp-01-21'
+# JSON mode and response schemas are not available on the thinking model.
+GEMINI_STRUCTURED_MODEL_NAME = 'gemini-2.0-flash'
+
+MODELFILE_PATH = os.path.join(os.path.dirname(__file__), "Modelfile")
+
+# Gemini generation config keys and their Ollama option names.
+OLLAMA_OPTIONS = {"temperature": "temperature", "top_p": "top_p", "top_k": "top_k", "max_output_tokens": "num_predict",
+                "stop_sequences": "stop", "seed": "seed"}
+
+
+class LLMBackend:
+    """
+    Base class of the LLM backends.
+    `generate` is the only method a backend has to implement, `stream` and `agenerate` fall back to it.
+    """
+    name = "llm"
+
+    def cache_name(self, response_schema=None):
+        """Name of the model answering a request, part of the response cache key."""
+        return self.name
+
+    def generate(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        """
+        Returns the response text of the model.
+        Parameters:
+            system_prompt (str): Instructions of the model.
+            prompt (str): The request.
+            generation_config (dict): Gemini style generation config, e.g. `{"temperature": 0.7}`.
+            response_schema (dict): When given, the response is a JSON document following this schema.
+        """
+        raise NotImplementedError
+
+    def stream(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        """Yields the response text in chunks as the model produces it."""
+        yield self.generate(system_prompt, prompt, generation_config, response_schema)
+
+    async def agenerate(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        """
+        Async version of `generate`, runs it in a worker thread unless the backend has a native async client.
+        A thread cannot be interrupted, so when the call is cancelled, e.g. by a timeout, the cancellation only
+        completes once the thread has returned. The caller keeps its concurrency slot until then, and the number of
+        requests the server sees stays bounded.
+        """
+        future = asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.generate, system_prompt, prompt, generation_config, response_schema))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Gemini API backend.
+    Requests with a response schema use JSON mode on `GEMINI_STRUCTURED_MODEL_NAME`, with their system prompt set as the
+    system instruction. The system prompt is the only prefix shared between requests and is far below the minimum size
+    of a Gemini context cache, so no context cache is used.
+    """
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL_NAME):
+        import google.generativeai as genai
+        self.genai = genai
+        genai.configure(api_key=api_key)
+        self.name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self._structured_models = {}
+        self._lock = threading.Lock()
+
+    def cache_name(self, response_schema=None):
+        return GEMINI_STRUCTURED_MODEL_NAME if response_schema else self.name
+
+    def _structured_model(self, system_prompt):
+        """Returns the JSON mode model for a system prompt, created once per system prompt."""
+        with self._lock:
+            if system_prompt not in self._structured_models:
+                self._structured_models[system_prompt] = self.genai.GenerativeModel(GEMINI_STRUCTURED_MODEL_NAME,
+                                                                                    system_instruction=system_prompt)
+            return self._structured_models[system_prompt]
+
+    def _request(self, system_prompt, prompt, generation_config, response_schema):
+        """Returns the model, the contents and the generation config of a request."""
+        if response_schema:
+            generation_config = {**(generation_config or {}), "response_mime_type": "application/json",
+                                "response_schema": response_schema}
+            return self._structured_model(system_prompt), [prompt], generation_config
+        return self.model, [system_prompt, prompt], generation_config
+
+    def generate(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        model, contents, generation_config = self._request(system_prompt, prompt, generation_config, response_schema)
+        return model.generate_content(contents=contents, generation_config=generation_config).text
+
+    def stream(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        model, contents, generation_config = self._request(system_prompt, prompt, generation_config, response_schema)
+        for chunk in model.generate_content(contents=contents, generation_config=generation_config, stream=True):
+            yield chunk.text
+
+    async def agenerate(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        model, contents, generation_config = await asyncio.to_thread(self._request, system_prompt, prompt,
+                                                                    generation_config, response_schema)
+        response = await model.generate_content_async(contents=contents, generation_config=generation_config)
+        return response.text
+
+
+def to_json_schema(schema):
+    """Converts a Gemini response schema (upper case OpenAPI types) to a JSON schema."""
+    if isinstance(schema, dict):
+        return {key: value.lower() if key == "type" and isinstance(value, str) else to_json_schema(value) for key, value in schema.items()}
+    if isinstance(schema, list):
+        return [to_json_schema(value) for value in schema]
+    return schema
+
+
+def read_modelfile(path=MODELFILE_PATH):
+    """
+    Reads the `FROM`, `PARAMETER` and `SYSTEM` instructions of an Ollama Modelfile.
+    Returns:
+        dict: `from`, `parameters` and `system`, in the format of the Ollama create API.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    model = {"parameters": {}}
+    if '"""' in text:
+        before, system, after = text.split('"""', 2)
+        model["system"] = system.strip()
+        text = before.replace("SYSTEM", "") + after
+    for line in text.splitlines():
+        parts = line.split(None, 2)
+        if len(parts) >= 2 and parts[0].upper() == "FROM":
+            model["from"] = parts[1]
+        elif len(parts) == 3 and parts[0].upper() == "PARAMETER":
+            try:
+                model["parameters"][parts[1]] = json.loads(parts[2])
+            except json.JSONDecodeError:
+                model["parameters"][parts[1]] = parts[2]
+    return model
+
+
+class OllamaBackend(LLMBackend):
+    """
+    Backend for an Ollama compatible server, using the chat API.
+    Every thread keeps one HTTP/1.1 connection open and reuses it for all its requests, and `keep_alive` keeps the
+    model loaded on the server between requests.
+    Parameters:
+        model (str): Model name on the server.
+        host (str): Base URL of the server.
+        timeout (float): Socket timeout of a request, in seconds.
+        keep_alive (str): How long the server keeps the model in memory after a request.
+        modelfile (str): If the model does not exist on the server, it is created from this Modelfile.
+    """
+
+    def __init__(self, model="forgetube", host="http://localhost:11434", timeout=300, keep_alive="10m",
+                modelfile=MODELFILE_PATH):
+        url = urlparse(host)
+        self.name = f"ollama/{model}"
+        self.model = model
+        self.host = url.hostname or "localhost"
+        self.port = url.port or 11434
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.modelfile = modelfile
+        self._local = threading.local()
+        self._model_checked = False
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def _close(self):
+        if getattr(self._local, "connection", None) is not None:
+            self._local.connection.close()
+            self._local.connection = None
+
+    def _post(self, path, body):
+        """Sends a POST request on the connection of this thread, reconnects once if the server closed it."""
+        payload = json.dumps(body).encode("utf-8")
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.request("POST", path, body=payload, headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._close()
+                if attempt == 1:
+                    raise
+                continue
+            if response.status != 200:
+                detail = response.read().decode("utf-8", "replace")
+                raise RuntimeError(f"Ollama request to {path} failed ({response.status}): {detail}")
+            return response
+
+    def ensure_model(self):
+        """Creates the model from the Modelfile if the server does not have it yet."""
+        if self._model_checked:
+            return
+        try:
+            self._post("/api/show", {"model": self.model}).read()
+        except RuntimeError:
+            if not self.modelfile or not os.path.isfile(self.modelfile):
+                raise
+            print(f"Creating the Ollama model '{self.model}' from {self.modelfile} ...")
+            self._post("/api/create", {"model": self.model, "stream": False, **read_modelfile(self.modelfile)}).read()
+        self._model_checked = True
+
+    def _body(self, system_prompt, prompt, generation_config, response_schema):
+        body = {
+            "model": self.model,
+            "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {OLLAMA_OPTIONS[key]: value for key, value in (generation_config or {}).items()
+                        if key in OLLAMA_OPTIONS},
+        }
+        if response_schema:
+            body["format"] = to_json_schema(response_schema)
+        return body
+
+    def stream(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        self.ensure_model()
+        response = self._post("/api/chat", self._body(system_prompt, prompt, generation_config, response_schema))
+        try:
+            # The server answers with one json object per line.
+            for line in response:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if message.get("error"):
+                    raise RuntimeError(f"Ollama error: {message['error']}")
+                yield message.get("message", {}).get("content", "")
+                if message.get("done"):
+                    break
+            response.read()
+        except GeneratorExit:
+            # The consumer stopped early, e.g. `first_json_document` has the whole document. Only the end of the
+            # response is left, reading it keeps the connection usable for the next request.
+            try:
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self._close()
+            raise
+        except BaseException:
+            self._close()
+            raise
+
+    def generate(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        return "".join(self.stream(system_prompt, prompt, generation_config, response_schema))
+
+
+def first_json_document(chunks):
+    """
+    Consumes a stream of text chunks and returns the first complete top level JSON object, as soon as its closing
+    brace arrives, the stream is closed without waiting for the rest of the text. Every character is scanned once, so
+    parsing keeps up with the stream instead of starting when the response is complete.
+    Returns:
+        str: The JSON object text, or the whole text if it never contains a complete object.
+    """
+    text = []
+    depth = 0
+    start = None
+    position = 0
+    in_string = False
+    escaped = False
+    for chunk in chunks:
+        text.append(chunk)
+        for char in chunk:
+            position += 1
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                # Strings are tracked before the object starts too, so a brace quoted in the prose does not open it.
+                in_string = True
+            elif char == "{":
+                if start is None:
+                    start = position - 1
+                depth += 1
+            elif char == "}" and start is not None:
+                depth -= 1
+                if depth == 0:
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+                    return "".join(text)[start:position]
+    return "".join(text)
+
+
+# Words of the canned narration, a fixed list so the scripts are identical on every machine.
+CANNED_WORDS = ("the quick study of light shows how distant stars form grow and fade while planets gather dust into "
+                "rings and moons that shape the history of every system across the galaxy over billions of years").split()
+
+
+def canned_script(scene_count=10, topic="Benchmark video", seed=0, words_per_scene=25):
+    """
+    Builds a synthetic script in the final format with `scene_count` scenes of about 10 seconds each.
+    The narration, prompts and seeds only depend on the arguments.
+    """
+    import random
+    rng = random.Random(seed)
+    audio_script = []
+    visual_script = []
+    for idx in range(scene_count):
+        words = [rng.choice(CANNED_WORDS) for _ in range(words_per_scene)]
+        start = idx * 10
+        audio_script.append({"timestamp": f"{start // 60:02d}:{start % 60:02d}",
+                            "text": " ".join(words[:12]).capitalize() + ". " + " ".join(words[12:]).capitalize() + ".",
+                            "speaker": rng.choice(["narrator_male", "narrator_female"]), "speed": 1.0, "pitch": 1.0,
+                            "emotion": "informative"})
+        visual_script.append({"timestamp_start": f"{start // 60:02d}:{start % 60:02d}",
+                            "timestamp_end": f"{(start + 10) // 60:02d}:{(start + 10) % 60:02d}",
+                            "prompt": f"A detailed photograph of {' '.join(words[:6])}",
+                            "negative_prompt": "blurry, low quality", "style": "realistic", "guidance_scale": 8,
+                            "steps": 50, "seed": rng.randint(100000, 9999999), "width": 1024, "height": 576})
+    return {"topic": topic, "description": f"Synthetic script with {scene_count} scenes.",
+            "audio_script": audio_script, "visual_script": visual_script}
+
+
+class CannedBackend(LLMBackend):
+    """
+    Offline backend that answers every request with the same `canned_script`, for benchmarks and tests without any
+    API key. Refinement requests get an empty patch.
+    """
+
+    def __init__(self, scene_count=10, topic="Benchmark video", seed=0):
+        self.name = f"canned/{scene_count}/{seed}"
+        self.script = json.dumps(canned_script(scene_count, topic, seed))
+
+    def generate(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        if prompt.lstrip().startswith("Video topic:"):
+            return json.dumps({"segments": []})
+        return self.script
+
+    def stream(self, system_prompt, prompt, generation_config=None, response_schema=None):
+        text = self.generate(system_prompt, prompt, generation_config, response_schema)
+        for i in range(0, len(text), 64):
+            yield text[i:i + 64]
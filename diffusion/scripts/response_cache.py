@@ -0,0 +1,30 @@
+import hashlib
+import json
+from file_cache import JSONFileCache
+
+
+class ResponseCache(JSONFileCache):
+    """
+    On-disk cache for LLM responses.
+    Every response is stored as `<sha256>.json` where the hash is computed from the model name, the hashes of the system
+    prompt and the prompt, and the generation config, i.e. everything that is sent to the model. Retries, batch jobs
+    with repeated topics and refinement loops get the stored response back instead of paying for the call again.
+    Besides the hits and misses, `coalesced` counts the calls that waited for an identical call already in flight.
+    """
+
+    def __init__(self, cache_dir="resources/cache/llm"):
+        super().__init__(cache_dir, "text")
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(model_name, system_prompt, prompt, generation_config=None):
+        """Returns the sha256 hex digest of the request."""
+        params = [model_name,
+                hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+                hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+                generation_config or {}]
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def stats(self):
+        """Returns the hit, miss and coalesced counters and the hit rate."""
+        return {**super().stats(), "coalesced": self.coalesced}
@@ -0,0 +1,62 @@
+'''
+README : Per-segment change sets between two versions of a script.
+A change set lists the indices of the `audio_script` and `visual_script` segments that differ between a script and its
+refined version, so the image and audio stages only regenerate the affected scenes. It is saved next to the script as
+`<name>.changes.json`, together with a fingerprint of the previous version and of the new script file.
+'''
+import json
+import os
+from file_cache import file_hash
+
+
+def diff_segments(old_segments, new_segments):
+    """Returns the sorted indices of the segments that were edited, added or removed."""
+    changed = [idx for idx, (old, new) in enumerate(zip(old_segments, new_segments)) if old != new]
+    changed += range(min(len(old_segments), len(new_segments)), max(len(old_segments), len(new_segments)))
+    return changed
+
+
+def diff_scripts(old_script, new_script):
+    """
+    Compares two versions of a script segment by segment.
+    Returns:
+        dict: `audio` and `visual`, the changed indices of `audio_script` and `visual_script`, and `audio_count` and
+        `visual_count`, the number of segments of the new script.
+    """
+    return {
+        "audio": diff_segments(old_script.get("audio_script", []), new_script.get("audio_script", [])),
+        "visual": diff_segments(old_script.get("visual_script", []), new_script.get("visual_script", [])),
+        "audio_count": len(new_script.get("audio_script", [])),
+        "visual_count": len(new_script.get("visual_script", [])),
+    }
+
+
+def changes_path(script_path):
+    return os.path.splitext(script_path)[0] + ".changes.json"
+
+
+def save_changes(script_path, changes, base=None):
+    """
+    Saves the change set of the script saved at `script_path`.
+    `base` identifies the previous version of the script, e.g. its pipeline fingerprint, so a stage can check that its
+    existing outputs were generated from it.
+    """
+    record = {**changes, "base": base, "script": file_hash(script_path)}
+    with open(changes_path(script_path), "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+
+
+def load_changes(script_path):
+    """
+    Returns:
+        dict: The change set of the script at `script_path`, or `None` if there is none or the script was modified
+        after the change set was saved.
+    """
+    try:
+        with open(changes_path(script_path), "r", encoding="utf-8") as f:
+            changes = json.load(f)
+        if changes.get("script") != file_hash(script_path):
+            return None
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return changes
@@ -0,0 +1,21 @@
+import hashlib
+import json
+from file_cache import JSONFileCache
+
+
+class SearchCache(JSONFileCache):
+    """
+    On-disk cache for web search results.
+    Every result is stored as `<sha256>.json` where the hash is computed from the query and the search parameters, the
+    API key is not part of the key. Entries older than `ttl` seconds are treated as misses, so the context of a video
+    stays reasonably fresh while repeated topics and retries do not pay for a SerpAPI call again.
+    """
+
+    def __init__(self, cache_dir="resources/cache/search", ttl=24 * 3600):
+        super().__init__(cache_dir, "snippets", ttl)
+
+    @staticmethod
+    def make_key(query, **params):
+        """Returns the sha256 hex digest of the normalized query and the search parameters."""
+        normalized = " ".join(query.lower().split())
+        return hashlib.sha256(json.dumps([normalized, params], sort_keys=True).encode("utf-8")).hexdigest()
@@ -0,0 +1,99 @@
+'''
+README : Building blocks shared by the on-disk caches (search results, LLM responses, images and audio).
+Every cache keeps one file per entry named after a sha256 key in its own folder. Entries are written to a temporary file
+and moved into place with `os.replace`, so a concurrent reader or a crash never leaves half an entry behind.
+`file_hash` is the content hash used everywhere a file is checked for changes.
+'''
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+def update_hash(digest, file_path):
+    """Feeds the contents of a file to a `hashlib` digest, block by block so large files are never fully in memory."""
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest
+
+
+def file_hash(file_path):
+    """Returns the sha256 hex digest of the contents of a file."""
+    return update_hash(hashlib.sha256(), file_path).hexdigest()
+
+
+def write_atomic(file_path, data):
+    """Writes `data` (bytes or str) to `file_path` through a temporary file and `os.replace`."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def copy_atomic(source_path, file_path):
+    """Copies `source_path` to `file_path` through a temporary file and `os.replace`."""
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, file_path)
+
+
+class FileCache:
+    """
+    Base class of the caches : one `<key><extension>` file per entry in `cache_dir`, and hit / miss counters.
+    """
+
+    def __init__(self, cache_dir, extension):
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.extension}")
+
+    def stats(self):
+        """Returns the hit and miss counters and the hit rate."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+class JSONFileCache(FileCache):
+    """
+    Cache of JSON values, every entry is stored as `{field: value}` in `<key>.json`.
+    Parameters:
+        cache_dir (str): Folder of the cache.
+        field (str): Name of the value in the entry files.
+        ttl (float): Entries older than `ttl` seconds are treated as misses, `None` keeps them forever.
+    """
+
+    def __init__(self, cache_dir, field, ttl=None):
+        super().__init__(cache_dir, ".json")
+        self.field = field
+        self.ttl = ttl
+
+    def fetch(self, key):
+        """
+        Returns:
+            The cached value for `key`, or `None` on a miss or if the entry is older than `ttl`.
+        """
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(self._path(key)) > self.ttl:
+                self.misses += 1
+                return None
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                value = json.load(f)[self.field]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def store(self, key, value):
+        """Saves a value for `key`."""
+        write_atomic(self._path(key), json.dumps({self.field: value}))
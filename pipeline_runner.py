@@ -0,0 +1,505 @@
+'''
+README : Resumable, checkpointed runner for the whole pipeline : script -> images -> audio -> subtitles -> video.
+The state of every stage is persisted in a json state file together with a fingerprint of its inputs and its outputs.
+When the runner is started again, a stage is skipped if it finished before, its outputs are unchanged on disk and the
+outputs of the stages it depends on are unchanged as well. A crash during assembly therefore never repeats the paid
+Gemini and GPU work.
+`--from-stage` forces a stage and all the following ones to run again, `--only-stage` runs a single stage.
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from file_cache import update_hash
+
+STAGES = ["script", "images", "audio", "subtitles", "video"]
+
+# Stages whose outputs are the inputs of a stage.
+DEPENDENCIES = {
+    "script": [],
+    "images": ["script"],
+    "audio": ["script"],
+    "subtitles": ["script", "audio"],
+    "video": ["script", "images", "audio", "subtitles"],
+}
+
+DEFAULT_CONFIG = {
+    "script_path": "resources/scripts/script.json",
+    "images_path": "resources/images/",
+    "audio_path": "resources/audio/",
+    "font_path": "resources/font/font.ttf",
+    "subtitles_dir": "resources/subtitles",
+    "video_dir": "resources/video",
+}
+
+
+def list_files(path):
+    """Returns the sorted list of files of a folder, or `[path]` if `path` is a file."""
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, file) for file in os.listdir(path)
+                    if os.path.isfile(os.path.join(path, file)))
+    return [path]
+
+
+def fingerprint(paths):
+    """
+    Returns a sha256 fingerprint of the names and contents of a list of files and folders.
+    Returns `None` if any of them is missing or a folder is empty, i.e. the artifact does not exist.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        files = list_files(path)
+        if not files or not all(os.path.isfile(file) for file in files):
+            return None
+        for file in files:
+            digest.update(os.path.basename(file).encode("utf-8"))
+            update_hash(digest, file)
+    return digest.hexdigest()
+
+
+def clear_folder(folder_path):
+    """Creates a folder, or deletes the files in it if it already exists, so a stage never mixes old and new outputs."""
+    os.makedirs(folder_path, exist_ok=True)
+    for file in list_files(folder_path):
+        os.remove(file)
+
+
+def remove_extra_scenes(folder_path, count):
+    """Deletes the files of the scenes whose index, the integer after the last `_` of the name, is `count` or more."""
+    for file in list_files(folder_path):
+        match = re.search(r"_(\d+)\.", os.path.basename(file))
+        if match and int(match.group(1)) >= count:
+            os.remove(file)
+
+
+def video_name(topic):
+    """Turns the topic of the video into a safe file name, the first 100 characters are used."""
+    topic = re.sub(r"[^A-Za-z0-9\s]+", " ", topic)
+    topic = re.sub(r"\s+", "_", topic)
+    return topic[:100]
+
+
+class PipelineRunner:
+    """
+    Runs the pipeline stages in order and checkpoints every finished stage in `state_path`.
+    Parameters:
+        config (dict): Folder paths (see `DEFAULT_CONFIG`) and the video request : `topic`, `duration`, `key_points`,
+        `feedback`, and the `gem_api` / `serp_api` keys for script generation. `threads` sets the number of torch
+        threads of the local image generation, `tts_workers` the number of TTS worker processes. `engine`, `segmented`
+        and `incremental` are the assembly options of `create_video`.
+        state_path (str): Path of the json state file.
+        local (bool): Run the image generation locally instead of on Modal.
+        shared (dict): Warm models shared with other runners : `image_worker`, a running `ImageGenerator`, and
+        `tts_pipeline`, a loaded `KPipeline`.
+        stage_limits (dict): Semaphore per stage name, limits how many runners execute that stage at the same time.
+    """
+
+    def __init__(self, config, state_path="resources/pipeline_state.json", local=False, shared=None, stage_limits=None):
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.state_path = state_path
+        self.local = local
+        self.shared = shared or {}
+        self.stage_limits = stage_limits or {}
+        self.state = self.load_state()
+        # Record of every stage before its current run, see `changed_scenes`.
+        self.previous_records = {}
+        # Audio timing table shared by the subtitles and video stages, see `timing_table`.
+        self.timing = None
+        # Stages can run concurrently, the lock protects the state and the state file.
+        self.lock = threading.Lock()
+
+    def load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"stages": {}}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def outputs(self, stage):
+        """Returns the files and folders produced by a stage."""
+        config = self.config
+        if stage == "script":
+            return [config["script_path"]]
+        if stage == "images":
+            return [config["images_path"]]
+        if stage == "audio":
+            return [config["audio_path"]]
+        name = video_name(self.load_script().get("topic", "video"))
+        if stage == "subtitles":
+            return [os.path.join(config["subtitles_dir"], f"{name}.srt")]
+        return [os.path.join(config["video_dir"], f"{name}.mp4")]
+
+    def scene_count(self):
+        """Number of scenes of the scene table, the table has the same number of audio and visual segments."""
+        from scene_table import load_scene_table
+        return len(load_scene_table(self.config["script_path"])["scenes"])
+
+    def timing_table(self):
+        """
+        Returns the timing table of the audio files, probed once per run and passed to both the subtitles and the video
+        stage instead of letting each of them probe every audio file again.
+        """
+        from assembly.scripts.assembly_video import get_files
+        from assembly.scripts.audio_timing import build_timing_table
+        with self.lock:
+            if self.timing is None:
+                self.timing = build_timing_table(get_files(self.config["audio_path"], (".mp3", ".wav")))
+            return self.timing
+
+    def load_script(self):
+        with open(self.config["script_path"], "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def input_fingerprint(self, stage):
+        """Fingerprint of the outputs of all the stages `stage` depends on."""
+        return [self.state["stages"].get(dependency, {}).get("outputs") for dependency in DEPENDENCIES[stage]]
+
+    def is_done(self, stage):
+        """A stage is done if it finished before, with the same inputs, and its outputs are unchanged on disk."""
+        record = self.state["stages"].get(stage)
+        if not record or record.get("status") != "done":
+            return False
+        if record.get("inputs") != self.input_fingerprint(stage):
+            return False
+        return record.get("outputs") == fingerprint(self.outputs(stage))
+
+    def changed_scenes(self, stage, kind):
+        """
+        Returns the indices of the scenes a stage has to regenerate after an incremental refinement of the script, or
+        `None` if the whole stage has to run : there is no change set, or the existing outputs of the stage were not
+        generated from the script the change set was computed against, or they were modified since.
+        Parameters:
+            stage (str): `images` or `audio`.
+            kind (str): `visual` or `audio`, the part of the script the stage is generated from.
+        """
+        from diffusion.scripts.script_changes import load_changes
+        record = self.previous_records.get(stage)
+        if not record or record.get("status") != "done" or record.get("outputs") != fingerprint(self.outputs(stage)):
+            return None
+        changes = load_changes(self.config["script_path"])
+        if changes is None or record.get("inputs") != [changes.get("base")]:
+            return None
+        return changes[kind]
+
+    def run(self, from_stage=None, only_stage=None, parallel=True, streaming=False):
+        """
+        Runs every stage that is not done yet.
+        The stages form a DAG (see `DEPENDENCIES`). A stage starts as soon as all the stages it depends on are finished,
+        so independent stages such as image generation (remote GPU) and audio synthesis (local CPU) run concurrently.
+        Parameters:
+            from_stage (str): Runs this stage and all the following ones again, even if they are done.
+            only_stage (str): Runs only this stage, even if it is done. Its inputs must already exist.
+            parallel (bool): When `False`, the stages run one after the other in the order of `STAGES`.
+            streaming (bool): Encode every scene of the video as soon as its image and audio exist, see `run_streaming`.
+        """
+        forced = set()
+        if from_stage:
+            forced = set(STAGES[STAGES.index(from_stage):])
+        stages = [only_stage] if only_stage else STAGES
+        if only_stage:
+            forced = {only_stage}
+        if streaming and not only_stage:
+            self.run_streaming(forced)
+            return
+        if not parallel:
+            for stage in stages:
+                self.run_stage(stage, stage in forced)
+            return
+
+        pending = list(stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            while pending or running:
+                if error is None:
+                    for stage in list(pending):
+                        if all(dependency not in pending and dependency not in running.values()
+                            for dependency in DEPENDENCIES[stage]):
+                            pending.remove(stage)
+                            running[executor.submit(self.run_stage, stage, stage in forced)] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    if future.exception() is not None and error is None:
+                        # Let the stages that are already running finish, but do not start the ones that depend on this one.
+                        error = future.exception()
+                        print(f"Stage '{stage}' failed: {error}")
+        if error is not None:
+            raise error
+
+    def run_streaming(self, forced=frozenset()):
+        """
+        Scene-level streaming run. Images and audio are generated concurrently, and every scene is handed to a
+        `StreamingAssembler` as soon as its files are saved, so its video segment is encoded while the other scenes are
+        still being generated. The video stage then only encodes the intro / outro and concatenates the segments.
+        Uses the ffmpeg assembly engine.
+        """
+        from assembly.scripts.ffmpeg_assembly import StreamingAssembler
+        from assembly.scripts.assembly_video import json_extract, get_files
+        self.run_stage("script", "script" in forced)
+        if "video" not in forced and all(self.is_done(stage) for stage in STAGES):
+            print("Stage 'video' is up to date, skipping.")
+            return
+        assembler = StreamingAssembler(json_extract(self.config["script_path"]), self.config["font_path"],
+                                    self.outputs("video")[0])
+        stage_callbacks = {"images": assembler.add_image, "audio": assembler.add_audio}
+
+        def run_media_stage(stage):
+            if not self.run_stage(stage, stage in forced, on_saved=stage_callbacks[stage]):
+                # The stage is up to date, hand its existing files to the assembler.
+                folder = self.config["images_path"] if stage == "images" else self.config["audio_path"]
+                extensions = ('.jpg', '.png') if stage == "images" else ('.mp3', '.wav')
+                for index, file_path in enumerate(get_files(folder, extensions)):
+                    stage_callbacks[stage](index, file_path)
+
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(run_media_stage, stage) for stage in ["images", "audio"]]
+                for future in futures:
+                    future.result()
+            self.run_stage("subtitles", "subtitles" in forced)
+        except BaseException:
+            assembler.close()
+            raise
+        self.run_stage("video", True, assembler=assembler)
+
+    def run_stage(self, stage, forced=False, **kwargs):
+        """
+        Runs a single stage unless it is done, and checkpoints it. `kwargs` are passed to the stage.
+        Returns:
+            bool: `True` if the stage ran, `False` if it was skipped.
+        """
+        if not forced and self.is_done(stage):
+            print(f"Stage '{stage}' is up to date, skipping.")
+            return False
+        limit = self.stage_limits.get(stage)
+        if limit is not None:
+            limit.acquire()
+        try:
+            print(f"Starting stage '{stage}' ...")
+            with self.lock:
+                self.previous_records[stage] = self.state["stages"].get(stage)
+                self.state["stages"][stage] = {"status": "running"}
+                self.save_state()
+            start_time = time.time()
+            getattr(self, f"run_{stage}")(**kwargs)
+        finally:
+            if limit is not None:
+                limit.release()
+        with self.lock:
+            self.state["stages"][stage] = {
+                "status": "done",
+                "inputs": self.input_fingerprint(stage),
+                "outputs": fingerprint(self.outputs(stage)),
+                "seconds": round(time.time() - start_time, 2),
+            }
+            self.save_state()
+        print(f"Stage '{stage}' done.")
+        return True
+
+    # STAGES
+
+    def run_script(self):
+        from diffusion.scripts.generate_script import VideoScriptGenerator
+        from scene_table import normalize_script, save_scene_table
+        config = self.config
+        backend = None
+        if config.get("llm_backend", "gemini") == "ollama":
+            from diffusion.scripts.llm_backends import OllamaBackend
+            backend = OllamaBackend(model=config.get("ollama_model", "forgetube"),
+                                    host=config.get("ollama_host", "http://localhost:11434"))
+            if not config.get("serp_api"):
+                print("No Serp API key, the script is generated without web context.")
+        elif (not config.get("gem_api")) or (not config.get("serp_api")):
+            raise ValueError("API Key not provided !\n Please Create your api key at : \n Serp APi : https://serpapi.com \n Gemini API : https://aistudio.google.com/apikey")
+        generator = VideoScriptGenerator(api_key=config.get("gem_api"), serp_api_key=config.get("serp_api"),
+                                        structured_output=config.get("structured_script", False), backend=backend,
+                                        stream_output=backend is not None)
+        if config.get("refine"):
+            self.refine_script(generator)
+            return
+        bypass_cache = config.get("bypass_llm_cache", False)
+        script = generator.generate_script(config["topic"], config["duration"], config["key_points"], bypass_cache)
+        print("Initial Script: ")
+        print(json.dumps(script, indent=2))
+        feedback = config.get("feedback")
+        if feedback is None:
+            feedback = input("Please provide feedback on the script (or type 'no' to skip refinement): ")
+        if feedback and feedback.lower() != "no":
+            script = generator.refine_script(script, feedback, bypass_cache)
+            print("\nRefined Script:")
+            print(json.dumps(script, indent=2))
+        if generator.response_cache is not None:
+            print(f"LLM response cache : {generator.response_cache.stats()}")
+        os.makedirs(os.path.dirname(config["script_path"]), exist_ok=True)
+        # Validate and normalize the script once, every later stage reads the scene table.
+        script = normalize_script(script)
+        generator.save_script(script, config["script_path"])
+        save_scene_table(config["script_path"], script)
+
+    def refine_script(self, generator):
+        """
+        Refines the existing script with `config["refine"]`, patching only the edited segments, and saves the change
+        set the images and audio stages use to regenerate only the affected scenes.
+        """
+        from diffusion.scripts.script_changes import diff_scripts, save_changes
+        from scene_table import normalize_script, save_scene_table
+        config = self.config
+        if not os.path.isfile(config["script_path"]):
+            raise FileNotFoundError(f"There is no script to refine at {config['script_path']}, generate one first.")
+        base = (self.previous_records.get("script") or {}).get("outputs")
+        existing_script = normalize_script(self.load_script())
+        script, _ = generator.refine_script_incremental(existing_script, config["refine"],
+                                                        config.get("refine_segments"),
+                                                        config.get("bypass_llm_cache", False))
+        script = normalize_script(script)
+        # The change set is computed on the normalized scripts, so it matches the scene table.
+        changes = diff_scripts(existing_script, script)
+        print(f"Changed segments : audio {changes['audio']}, visual {changes['visual']}")
+        generator.save_script(script, config["script_path"])
+        save_scene_table(config["script_path"], script)
+        save_changes(config["script_path"], changes, base)
+
+    def run_images(self, on_saved=None):
+        if self.local:
+            from diffusion.scripts.generate_image_local import main_generate_image
+        else:
+            from diffusion.scripts.generate_image import main_generate_image
+        changed = self.changed_scenes("images", "visual")
+        if changed is None:
+            clear_folder(self.config["images_path"])
+        else:
+            print(f"Regenerating the images of scenes {changed}")
+            remove_extra_scenes(self.config["images_path"], self.scene_count())
+        if self.local:
+            main_generate_image(self.config["script_path"], self.config["images_path"], on_saved=on_saved,
+                                threads=self.config.get("threads"), only_indices=changed)
+        else:
+            main_generate_image(self.config["script_path"], self.config["images_path"], on_saved=on_saved,
+                                worker=self.shared.get("image_worker"), only_indices=changed)
+        expected = self.scene_count()
+        found = len([file for file in list_files(self.config["images_path"]) if file.lower().endswith((".png", ".jpg"))])
+        if found < expected:
+            raise RuntimeError(f"Only {found} of {expected} images were generated.")
+
+    def run_audio(self, on_saved=None):
+        from tts.scripts.generate_audio import main_generate_audio
+        changed = self.changed_scenes("audio", "audio")
+        if changed is None:
+            clear_folder(self.config["audio_path"])
+        else:
+            print(f"Regenerating the audio of segments {changed}")
+            remove_extra_scenes(self.config["audio_path"], self.scene_count())
+        self.timing = None
+        main_generate_audio(self.config["script_path"], self.config["audio_path"],
+                            workers=self.config.get("tts_workers", 1), on_saved=on_saved,
+                            pipeline=self.shared.get("tts_pipeline"), only_indices=changed)
+
+    def run_subtitles(self):
+        from assembly.scripts.assembly_video import create_complete_srt
+        os.makedirs(self.config["subtitles_dir"], exist_ok=True)
+        create_complete_srt(script_folder=self.config["script_path"],
+                            audio_file_folder=self.config["audio_path"],
+                            outfile_path=self.outputs("subtitles")[0],
+                            chunk_size=10,
+                            timing=self.timing_table())
+
+    def run_video(self, assembler=None):
+        from assembly.scripts.assembly_video import create_video
+        os.makedirs(self.config["video_dir"], exist_ok=True)
+        if assembler is not None:
+            assembler.finish(self.load_script().get("topic", ""), self.scene_count())
+            return
+        create_video(self.config["images_path"], self.config["audio_path"], self.config["script_path"],
+                    self.config["font_path"], self.outputs("video")[0], with_subtitles=True,
+                    engine=self.config.get("engine", "moviepy"), segmented=self.config.get("segmented", False),
+                    incremental=self.config.get("incremental", False), timing=self.timing_table())
+
+
+def run_cli(gem_api, serp_api, local=False):
+    """
+    Command line entry point used by `main.py` and `main_local.py`.
+    The video request is asked for interactively only when the script stage has to run, and it is kept in the state
+    file so a restarted run does not ask again.
+    """
+    parser = argparse.ArgumentParser(description="Run the ForgeTube pipeline, resuming from the last finished stage.")
+    parser.add_argument("--from-stage", choices=STAGES, help="Run this stage and all the following ones again.")
+    parser.add_argument("--only-stage", choices=STAGES, help="Run only this stage.")
+    parser.add_argument("--state", default="resources/pipeline_state.json", help="Path of the pipeline state file.")
+    parser.add_argument("--new", action="store_true", help="Forget the previous run and start a new video.")
+    parser.add_argument("--sequential", action="store_true", help="Run the stages one after the other.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Encode every scene as soon as its image and audio exist (uses ffmpeg).")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="Ask Gemini again instead of reusing cached responses for the same request.")
+    parser.add_argument("--structured-script", action="store_true",
+                        help="Generate the script in a single Gemini call with a JSON response schema.")
+    parser.add_argument("--llm", choices=["gemini", "ollama"], default="gemini",
+                        help="LLM backend of the script stage, ollama uses a local Ollama server.")
+    parser.add_argument("--ollama-model", default="forgetube",
+                        help="Ollama model name, created from diffusion/scripts/Modelfile if it does not exist.")
+    parser.add_argument("--ollama-host", default="http://localhost:11434", help="URL of the Ollama server.")
+    parser.add_argument("--refine", metavar="FEEDBACK",
+                        help="Refine the existing script and regenerate only the scenes that changed.")
+    parser.add_argument("--segments", help="Comma separated indices of the segments --refine is about, e.g. 2,5.")
+    parser.add_argument("--engine", choices=["moviepy", "ffmpeg"],
+                        help="Video assembly engine, defaults to moviepy, or ffmpeg with --segmented / --incremental.")
+    parser.add_argument("--segmented", action="store_true",
+                        help="Encode the intro, every scene and the outro in parallel (ffmpeg engine).")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-encode the scenes that changed since the last assembly (ffmpeg engine). "
+                            "On by default with --refine unless --engine moviepy is given.")
+    parser.add_argument("--tts-workers", type=int, default=1,
+                        help="Number of TTS worker processes, each with its own Kokoro pipeline.")
+    if local:
+        parser.add_argument("--threads", type=int, default=None,
+                            help="Number of CPU threads torch uses for the local image generation.")
+    args = parser.parse_args()
+    if args.refine and (args.new or not os.path.isfile(DEFAULT_CONFIG["script_path"])):
+        parser.error("--refine needs an existing script, run the pipeline without --refine first.")
+
+    # A refinement only changes a few scenes, so only those are encoded again.
+    incremental = args.incremental or (bool(args.refine) and args.engine != "moviepy")
+    if (incremental or args.segmented) and args.engine == "moviepy":
+        parser.error("--segmented and --incremental need the ffmpeg engine.")
+    engine = args.engine or ("ffmpeg" if incremental or args.segmented else "moviepy")
+
+    runner = PipelineRunner({"gem_api": gem_api, "serp_api": serp_api, "bypass_llm_cache": args.no_llm_cache,
+                            "structured_script": args.structured_script, "refine": args.refine,
+                            "llm_backend": args.llm, "ollama_model": args.ollama_model, "ollama_host": args.ollama_host,
+                            "refine_segments": [int(idx) for idx in args.segments.split(",")] if args.segments else None,
+                            "threads": getattr(args, "threads", None), "tts_workers": args.tts_workers,
+                            "engine": engine, "segmented": args.segmented, "incremental": incremental},
+                            state_path=args.state, local=local)
+    if args.new:
+        runner.state = {"stages": {}}
+    request = runner.state.get("request")
+    script_needed = not args.refine and (args.only_stage == "script" or args.from_stage == "script"
+                                        or (not args.only_stage and not runner.is_done("script")))
+    if script_needed and request is None:
+        request = {}
+        request["topic"] = input("Enter the topic of the video : ")
+        request["duration"] = int(input("Enter the video duration in seconds : "))
+        input_string = input("Enter a list of key points separated by commas : ")
+        request["key_points"] = [word.strip() for word in input_string.split(",")]
+        runner.state["request"] = request
+        runner.save_state()
+    runner.config.update(request or {})
+    if args.refine:
+        # The script stage runs again, and the images and audio stages only regenerate the changed scenes.
+        args.from_stage = "script"
+    runner.run(from_stage=args.from_stage, only_stage=args.only_stage, parallel=not args.sequential,
+            streaming=args.streaming)
@@ -0,0 +1,232 @@
+'''
+README : Validation and normalization of the generated script, and the scene table every later stage reads.
+The LLM output is not trusted as is : the `audio_script` and `visual_script` can have different lengths, timestamps can
+be malformed or out of order (e.g. "15:00" between "00:05" and "00:20") and numeric parameters can be out of range.
+`normalize_script` fixes all of it once, right after the script is generated, and `build_scene_table` turns the result
+into a compact table with one typed row per scene. The table is saved next to the script as `<name>.scenes.json`.
+The image, audio, subtitle and video stages call `load_scene_table` instead of parsing the script json themselves.
+'''
+import json
+import os
+import re
+import zlib
+from typing import NamedTuple
+from file_cache import file_hash
+
+# (minimum, maximum) of the numeric parameters, out of range values are clamped.
+PARAM_RANGES = {
+    "speed": (0.8, 1.2),
+    "pitch": (0.9, 1.2),
+    "guidance_scale": (1.0, 20.0),
+    "steps": (10, 100),
+    "seed": (0, 2**32 - 1),
+    "width": (256, 2048),
+    "height": (256, 2048),
+}
+
+DEFAULTS = {"speaker": "default", "speed": 1.0, "pitch": 1.0, "emotion": "neutral", "negative_prompt": "",
+            "style": "realistic", "guidance_scale": 9.0, "steps": 50, "width": 1024, "height": 576}
+
+# Narration speed used to estimate the length of a scene whose timestamps are missing.
+WORDS_PER_SECOND = 2.5
+
+
+class Scene(NamedTuple):
+    """One row of the scene table. `start` and `end` are planned times in seconds from the start of the narration."""
+    id: int
+    start: float
+    end: float
+    text: str
+    prompt: str
+    negative_prompt: str
+    seed: int
+    speaker: str
+    speed: float
+    steps: int
+    guidance_scale: float
+    width: int
+    height: int
+
+
+def parse_timestamp(value):
+    """
+    Parses a timestamp into seconds.
+    Accepts "SS", "MM:SS", "HH:MM:SS" and numbers.
+    Returns:
+        float: The time in seconds, or `None` if `value` is not a valid timestamp.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value) if value >= 0 else None
+    if not isinstance(value, str) or not re.fullmatch(r"\d+(:\d{1,2}){0,2}(\.\d+)?", value.strip()):
+        return None
+    seconds = 0.0
+    for part in value.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def format_timestamp(seconds):
+    """Formats seconds as "MM:SS"."""
+    seconds = int(round(seconds))
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def clamp(name, value):
+    """Converts a parameter to its type and clamps it to `PARAM_RANGES`, invalid values fall back to `DEFAULTS`."""
+    low, high = PARAM_RANGES[name]
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = DEFAULTS.get(name, low)
+    value = min(max(value, low), high)
+    return int(round(value)) if isinstance(low, int) else value
+
+
+def default_seed(prompt):
+    """Stable seed derived from the prompt, so an unseeded scene renders the same image on every run."""
+    return zlib.crc32(prompt.encode("utf-8"))
+
+
+def normalize_script(script):
+    """
+    Validates and normalizes a generated script.
+    - `audio_script` and `visual_script` get the same length : extra visual segments are dropped, and extra audio
+    segments reuse the previous visual segment so no narration is lost.
+    - Timestamps are parsed, and the ones that are malformed or not increasing are replaced by the end of the previous
+    segment. Every segment ends where the next one starts, the last one after an estimate of its narration time.
+    - Numeric parameters are clamped to `PARAM_RANGES`, missing ones are set to `DEFAULTS`, and missing seeds are
+    derived from the prompt.
+    Returns:
+        dict: The normalized script, in the same format as the input.
+    Raises:
+        ValueError: If the script has no narration.
+    """
+    audio_script = [segment for segment in script.get("audio_script") or [] if isinstance(segment, dict)
+                    and str(segment.get("text", "")).strip()]
+    visual_script = [segment for segment in script.get("visual_script") or [] if isinstance(segment, dict)]
+    if not audio_script:
+        raise ValueError("The script has no audio segments.")
+    if len(audio_script) != len(visual_script):
+        print(f"Script has {len(audio_script)} audio and {len(visual_script)} visual segments, pairing them by index.")
+    if not visual_script:
+        visual_script = [{"prompt": script.get("topic", "")}]
+    visual_script = [visual_script[min(idx, len(visual_script) - 1)] for idx in range(len(audio_script))]
+
+    starts = []
+    for audio, visual in zip(audio_script, visual_script):
+        start = parse_timestamp(audio.get("timestamp"))
+        if start is None:
+            start = parse_timestamp(visual.get("timestamp_start"))
+        starts.append(start)
+    # Drop the timestamps that break the order, an outlier is later than the timestamp that follows it.
+    last_start = -1.0
+    for idx, start in enumerate(starts):
+        if start is None:
+            continue
+        following = next((value for value in starts[idx + 1:] if value is not None), None)
+        if start <= last_start or (following is not None and last_start < following <= start):
+            starts[idx] = None
+        else:
+            last_start = start
+    normalized_audio = []
+    normalized_visual = []
+    previous_end = 0.0
+    for idx, (audio, visual) in enumerate(zip(audio_script, visual_script)):
+        text = str(audio["text"]).strip()
+        start = starts[idx] if starts[idx] is not None and starts[idx] >= previous_end else previous_end
+        next_start = starts[idx + 1] if idx + 1 < len(starts) else None
+        if next_start is not None and next_start > start:
+            end = next_start
+        else:
+            end = start + max(1.0, len(text.split()) / WORDS_PER_SECOND)
+        previous_end = end
+        prompt = str(visual.get("prompt") or text)
+        normalized_audio.append({
+            **audio,
+            "timestamp": format_timestamp(start),
+            "text": text,
+            "speaker": audio.get("speaker") or DEFAULTS["speaker"],
+            "speed": clamp("speed", audio.get("speed", DEFAULTS["speed"])),
+            "pitch": clamp("pitch", audio.get("pitch", DEFAULTS["pitch"])),
+            "emotion": audio.get("emotion") or DEFAULTS["emotion"],
+        })
+        normalized_visual.append({
+            **visual,
+            "timestamp_start": format_timestamp(start),
+            "timestamp_end": format_timestamp(end),
+            "prompt": prompt,
+            "negative_prompt": str(visual.get("negative_prompt") or DEFAULTS["negative_prompt"]),
+            "style": visual.get("style") or DEFAULTS["style"],
+            "guidance_scale": clamp("guidance_scale", visual.get("guidance_scale", DEFAULTS["guidance_scale"])),
+            "steps": clamp("steps", visual.get("steps", DEFAULTS["steps"])),
+            "seed": clamp("seed", visual["seed"]) if visual.get("seed") is not None else default_seed(prompt),
+            # Stable Diffusion needs sizes that are multiples of 8.
+            "width": clamp("width", visual.get("width", DEFAULTS["width"])) // 8 * 8,
+            "height": clamp("height", visual.get("height", DEFAULTS["height"])) // 8 * 8,
+        })
+    return {**script, "audio_script": normalized_audio, "visual_script": normalized_visual}
+
+
+def build_scene_table(script):
+    """
+    Builds the scene table of a normalized script.
+    Returns:
+        list: One `Scene` per segment, in order.
+    """
+    scenes = []
+    for idx, (audio, visual) in enumerate(zip(script["audio_script"], script["visual_script"])):
+        scenes.append(Scene(id=idx,
+                            start=float(parse_timestamp(visual["timestamp_start"])),
+                            end=float(parse_timestamp(visual["timestamp_end"])),
+                            text=audio["text"],
+                            prompt=visual["prompt"],
+                            negative_prompt=visual["negative_prompt"],
+                            seed=visual["seed"],
+                            speaker=audio["speaker"],
+                            speed=audio["speed"],
+                            steps=visual["steps"],
+                            guidance_scale=visual["guidance_scale"],
+                            width=visual["width"],
+                            height=visual["height"]))
+    return scenes
+
+
+def scene_table_path(script_path):
+    return os.path.splitext(script_path)[0] + ".scenes.json"
+
+
+def save_scene_table(script_path, script):
+    """
+    Saves the scene table of the normalized script saved at `script_path`, with a hash of the script file to detect
+    stale tables.
+    Returns:
+        dict: The saved table.
+    """
+    table = {"script": file_hash(script_path), "topic": script.get("topic", ""),
+            "description": script.get("description", ""),
+            "scenes": [list(scene) for scene in build_scene_table(script)]}
+    with open(scene_table_path(script_path), "w", encoding="utf-8") as f:
+        json.dump(table, f, separators=(",", ":"))
+    return table
+
+
+def load_scene_table(script_path):
+    """
+    Loads the scene table of a script. If the table is missing or older than the script, e.g. the script was edited by
+    hand, the script is normalized again and a new table is saved.
+    Returns:
+        dict: `topic`, `description` and `scenes`, a list of `Scene`.
+    """
+    table_path = scene_table_path(script_path)
+    try:
+        with open(table_path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        if table.get("script") != file_hash(script_path):
+            table = None
+    except (FileNotFoundError, json.JSONDecodeError):
+        table = None
+    if table is None:
+        with open(script_path, "r", encoding="utf-8") as f:
+            table = save_scene_table(script_path, normalize_script(json.load(f)))
+    return {"topic": table["topic"], "description": table["description"],
+            "scenes": [Scene(*row) for row in table["scenes"]]}
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from importlib import metadata
+from file_cache import FileCache, copy_atomic
+
+
+def kokoro_version():
+    """Returns the installed Kokoro version, so a model upgrade invalidates the cache."""
+    try:
+        return metadata.version("kokoro")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class AudioCache(FileCache):
+    """
+    Persistent cache for synthesized audio segments.
+    The audio files are stored as `<sha256>.wav` blobs in `cache_dir`, and a SQLite index keeps their size and last use
+    time. The key is computed from everything that changes the synthesized audio: the text, the voice, the speed,
+    the language code and the Kokoro version.
+    The cache is bounded by `max_bytes`, the least recently used segments are evicted first.
+    """
+
+    def __init__(self, cache_dir="resources/cache/audio", max_bytes=1024**3):
+        super().__init__(cache_dir, ".wav")
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self.db.commit()
+
+    @staticmethod
+    def make_key(text, voice, speed, lang_code="b", version=None):
+        """
+        Returns the sha256 hex digest of the synthesis parameters.
+        `version` identifies the TTS backend, it defaults to the installed Kokoro version.
+        """
+        params = [text, voice, speed, lang_code, version or kokoro_version()]
+        return hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()
+
+    def _sidecar_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.words.json")
+
+    def fetch(self, key, file_path, sidecar_path=None):
+        """
+        Copies the cached audio for `key` to `file_path`, and its word timing sidecar to `sidecar_path` if both exist.
+        Returns:
+            bool: `True` on a cache hit, `False` on a miss.
+        """
+        row = self.db.execute("SELECT key FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.isfile(self._path(key)):
+            self.misses += 1
+            return False
+        shutil.copyfile(self._path(key), file_path)
+        if sidecar_path and os.path.isfile(self._sidecar_path(key)):
+            shutil.copyfile(self._sidecar_path(key), sidecar_path)
+        self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        self.hits += 1
+        return True
+
+    def store(self, key, file_path, sidecar_path=None):
+        """
+        Adds the audio file at `file_path`, and the sidecar at `sidecar_path` if given, to the cache and evicts old
+        entries if the cache is too large.
+        """
+        if sidecar_path and os.path.isfile(sidecar_path):
+            shutil.copyfile(sidecar_path, self._sidecar_path(key))
+        copy_atomic(file_path, self._path(key))
+        self.db.execute("INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+                        (key, os.path.getsize(self._path(key)), time.time()))
+        self.db.commit()
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used segments until the cache fits in `max_bytes`."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            for path in (self._path(key), self._sidecar_path(key)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -1,63 +1,138 @@
 
-from pydub import AudioSegment
 import json
-import io
 import soundfile as sf
 import os
+import multiprocessing
 from kokoro.pipeline import KPipeline
+from tts.scripts.audio_cache import AudioCache
+from scene_table import load_scene_table
 
-def generate_audio(script_data):
-    pipeline = KPipeline(lang_code="b")
-        
-    all_audio = []
-    for segment in script_data["audio_script"]:
-        speaker_id = "am_adam" if segment["speaker"] in ["default", "narrator_male"] else "af_heart"
-        audio = pipeline(text=segment["text"], voice=speaker_id, speed=segment["speed"])
-        
-        # Collect audio chunks
-        buffer = io.BytesIO()
-        for _, _, chunk in audio:
-            sf.write(buffer, chunk, 24000, format='WAV')
-        buffer.seek(0)
-        all_audio.append(buffer.read())
+def get_voice(speaker):
+    """Maps the `speaker` of an audio segment to a Kokoro voice."""
+    return "am_adam" if speaker in ["default", "narrator_male"] else "af_heart"
+
+def word_timings_path(audio_path):
+    """Returns the path of the word timing sidecar that belongs to an audio file."""
+    return os.path.splitext(audio_path)[0] + ".words.json"
+
+def synthesize_segment(pipeline, segment, output_path):
+    """
+    Synthesizes a single audio segment on `pipeline` and streams it to `output_path`.
+    Chunks are appended to one open WAV file as the generator yields them, so only a single chunk is held in memory,
+    and the header is finalized with the correct length when the file is closed.
+    The per-token timestamps Kokoro produces are saved next to the audio file as `<name>.words.json`, in the compact
+    form `{"words": [[text, start, end], ...]}` with times in seconds from the start of the segment.
+    """
+    results = pipeline(text=segment["text"], voice=get_voice(segment["speaker"]), speed=segment["speed"])
     
-    return all_audio
+    words = []
+    offset = 0.0
+    with sf.SoundFile(output_path, "w", samplerate=24000, channels=1, subtype="PCM_16", format="WAV") as f:
+        for result in results:
+            chunk = result.audio
+            if chunk is None:
+                continue
+            f.write(chunk.numpy() if hasattr(chunk, "numpy") else chunk)
+            # Timestamps are relative to the chunk, shift them by the audio written so far.
+            end = offset
+            for token in getattr(result, "tokens", None) or []:
+                start = token.start_ts if token.start_ts is not None else end
+                end = token.end_ts if token.end_ts is not None else start
+                words.append([token.text + (token.whitespace or ""), round(offset + start, 3), round(offset + end, 3)])
+            offset += len(chunk) / 24000
+    
+    with open(word_timings_path(output_path), "w", encoding="utf-8") as f:
+        json.dump({"words": words}, f, separators=(",", ":"))
+    return output_path
+
+# Every worker process of the pool holds its own warm pipeline.
+_worker_pipeline = None
 
-def merge_audio(audio_path,audio_bytes_list):
-    # Create output directory
-    # os.makedirs("output_audio", exist_ok=True)
+def _init_worker(threads):
+    global _worker_pipeline
+    import torch
+    torch.set_num_threads(threads)
+    _worker_pipeline = KPipeline(lang_code="b")
+    # Load the voice tensors once, instead of on the first segment that uses them.
+    for voice in ["am_adam", "af_heart"]:
+        _worker_pipeline.load_voice(voice)
+
+def _synthesize_indexed(job):
+    idx, segment, output_path = job
+    return idx, synthesize_segment(_worker_pipeline, segment, output_path)
+
+def generate_audio(script_data, audio_path, workers=1, cache=None, on_saved=None, pipeline=None, only_indices=None):
+    """
+    Synthesizes every segment of `script_data["audio_script"]` into `audio_path/segment_<idx>.wav`.
+    Args:
+        script_data (dict): The loaded script.
+        audio_path (str): Folder where the audio files are saved.
+        workers (int): Number of worker processes. With more than one worker the segments are sharded across a pool
+        of processes, each with its own `KPipeline`, and reassembled in order.
+        cache (AudioCache): Optional cache, segments found in it are copied instead of synthesized.
+        on_saved (callable): Called as `on_saved(index, file_path)` as soon as a segment and its sidecar are on disk.
+        pipeline (KPipeline): An already loaded pipeline, e.g. shared by several videos, used when `workers` is 1.
+        only_indices (list): Indices of the segments to synthesize, e.g. the segments edited by a refinement. The files
+        of the other segments are kept as they are in `audio_path`.
+    Returns:
+        list: Paths of the audio files, in script order.
+    """
+    segments = script_data["audio_script"]
+    audio_files = [f"{audio_path}/segment_{idx}.wav" for idx in range(len(segments))]
+    cache_keys = {}
+    jobs = []
+    for idx, segment in enumerate(segments):
+        if only_indices is not None and idx not in only_indices and os.path.isfile(audio_files[idx]):
+            print(f"Audio file: {idx} kept : {audio_files[idx]}")
+            if on_saved is not None:
+                on_saved(idx, audio_files[idx])
+            continue
+        if cache is not None:
+            # A stand-in pipeline such as the benchmark stub names itself, so its audio never replaces Kokoro output.
+            cache_keys[idx] = AudioCache.make_key(segment["text"], get_voice(segment["speaker"]), segment["speed"],
+                                                version=getattr(pipeline, "cache_name", None))
+            if cache.fetch(cache_keys[idx], audio_files[idx], word_timings_path(audio_files[idx])):
+                print(f"Audio file: {idx} taken from cache : {audio_files[idx]}")
+                if on_saved is not None:
+                    on_saved(idx, audio_files[idx])
+                continue
+        jobs.append((idx, segment, audio_files[idx]))
     
-    # Save segments locally
-    audio_files = []
-    for idx, audio_bytes in enumerate(audio_bytes_list):
-        output_path = f"{audio_path}/segment_{idx}.wav"
-        with open(output_path, "wb") as f:
-            f.write(audio_bytes)
-        audio_files.append(output_path)
+    def on_done(idx, output_path):
+        if cache is not None:
+            cache.store(cache_keys[idx], output_path, word_timings_path(output_path))
         print(f"Audio file: {idx} successfully saved at : {output_path}")
+        if on_saved is not None:
+            on_saved(idx, output_path)
     
-    # Merge audio files (not really needed)
-    # master_audio = AudioSegment.empty()
-    # for file in audio_files:
-    #     master_audio += AudioSegment.from_wav(file)
+    workers = max(1, min(workers, len(jobs)))
+    if jobs and workers == 1:
+        pipeline = pipeline or KPipeline(lang_code="b")
+        for idx, segment, output_path in jobs:
+            on_done(idx, synthesize_segment(pipeline, segment, output_path))
+    elif jobs:
+        # Split the cores between the workers so torch does not oversubscribe the CPU.
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+            for idx, output_path in pool.imap_unordered(_synthesize_indexed, jobs):
+                on_done(idx, output_path)
     
-    # Export final file
-    # master_output_path = f"{audio_path}/master_output.wav"
-    # master_audio.export(master_output_path, format="wav")
-    # return master_output_path
-
-def main_generate_audio(script_path,audio_path):
-    # Load script data
-    with open(script_path) as f:
-        script_data = json.load(f)
-    
-    # Generate audio
-    audio_bytes_list = generate_audio(script_data)
+    if cache is not None:
+        print(f"Audio cache : {cache.stats()}")
+    return audio_files
+
+def main_generate_audio(script_path,audio_path,workers=1,use_cache=True,cache_dir="resources/cache/audio",on_saved=None,pipeline=None,only_indices=None):
+    # Load the scene table, the segments are already validated and their parameters clamped
+    scenes = load_scene_table(script_path)["scenes"]
+    script_data = {"audio_script": [scene._asdict() for scene in scenes]}
     
-    # Merge and save final audio
-    final_path = merge_audio(audio_path,audio_bytes_list)
+    # Generate audio, every segment is streamed straight to its own file
+    cache = AudioCache(cache_dir) if use_cache else None
+    audio_files = generate_audio(script_data, audio_path, workers, cache, on_saved, pipeline, only_indices)
+    if cache is not None:
+        cache.close()
     
-    print(f"Audio generation complete! Saved as {final_path}")
+    print(f"Audio generation complete! Saved {len(audio_files)} files in {audio_path}")
 
 # if __name__ == "__main__":
 #     main_generate_audio(script_path="resources/scripts/script.json",audio_path="resources/audio")
\ No newline at end of file
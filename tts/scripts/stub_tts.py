@@ -0,0 +1,43 @@
+'''
+README : Offline stand-in for the Kokoro `KPipeline`, used by the benchmark and for tests without the TTS model.
+Every word is rendered as a short sine tone, so a segment lasts as long as the narration would (about
+`words_per_second` words per second at speed 1.0) and gets word timestamps like the real pipeline. The output only
+depends on the text, the voice and the speed. It can be passed as `pipeline` to `main_generate_audio`, its
+`cache_name` keeps the sine tones apart from the Kokoro audio in the audio cache.
+'''
+import zlib
+from types import SimpleNamespace
+import numpy as np
+
+SAMPLE_RATE = 24000
+
+
+class SineTonePipeline:
+    """
+    Callable with the interface of `KPipeline` : `pipeline(text=..., voice=..., speed=...)` yields one result per
+    sentence, with the `audio` samples and the `tokens` timestamps relative to the result.
+    """
+
+    def __init__(self, words_per_second=2.5, sample_rate=SAMPLE_RATE):
+        self.words_per_second = words_per_second
+        self.sample_rate = sample_rate
+        self.cache_name = f"stub-sine-tone/{words_per_second}/{sample_rate}"
+
+    def load_voice(self, voice):
+        pass
+
+    def __call__(self, text, voice="am_adam", speed=1.0):
+        frequency = 180 + zlib.crc32(voice.encode("utf-8")) % 120
+        word_duration = 1 / (self.words_per_second * speed)
+        sentences = [sentence.strip() for sentence in text.replace("!", ".").replace("?", ".").split(".")]
+        for sentence in filter(None, sentences):
+            words = sentence.split()
+            samples = int(len(words) * word_duration * self.sample_rate)
+            t = np.arange(samples) / self.sample_rate
+            # A silent gap at the end of every word, like the pauses of real speech.
+            envelope = (t % word_duration) < word_duration * 0.8
+            audio = (0.2 * np.sin(2 * np.pi * frequency * t) * envelope).astype(np.float32)
+            tokens = [SimpleNamespace(text=word, whitespace=" ", start_ts=i * word_duration,
+                                    end_ts=(i + 0.8) * word_duration)
+                    for i, word in enumerate(words)]
+            yield SimpleNamespace(audio=audio, tokens=tokens)